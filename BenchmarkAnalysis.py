@@ -0,0 +1,282 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import contextlib
+import io
+import numpy as np
+import awkward as ak
+import uproot
+from coffea.nanoevents import transforms
+from coffea.nanoevents.schemas.base import zip_forms, listarray_form
+from magiconfig import ArgumentParser, ArgumentDefaultsRawHelpFormatter
+from common import DelphesSchema2, load_events, resolve_constituents, constituents_cache_dir
+from Histogram import select_events, BASE_CUTS, calc_rinv, jet_substructure, jet_shape, recluster, KT_CUTS, N_ECF, derive_columns, make_histograms, histogram, HIST_COLUMNS
+from BenchmarkIO import best_time
+
+# Synthetic Delphes-like events, so that the analysis can be benchmarked without Pythia or Delphes.
+# The events are written in the Delphes branch layout ({collection}/{collection}.{field} with a {collection}_size counter),
+# except for what uproot cannot write (TRefArray, TLorentzVector, and doubly jagged branches):
+# - {jet}.Constituents.refs: constituent references of all jets in an event, with the number per jet in {jet}.Constituents.fSize (as in TRefArray)
+# - FatJet.Tau_5: N-subjettiness of all jets in an event (5 per jet)
+# - FatJet.SoftDroppedJet.fP.fX, ..., FatJet.SoftDroppedJet.fE: TLorentzVector members
+# SyntheticDelphesSchema nests these back into the forms of the Delphes branches, so that the events go through
+# load_events() and histogram() like a Delphes file (DelphesSchema2, branch filter, constituents cache).
+
+JETS = ["FatJet", "DarkHadronJet", "DarkHadronVisibleJet", "DarkHadronStableJet"]
+# per-jet lists and arrays stored flat per event, with their own counter
+FLAT_FIELDS = ["Constituents.refs", "Tau_5"]
+
+# PDG IDs of a generic dark sector (mediator, dark hadrons, stable invisible states)
+class SyntheticHelper:
+    mmed = 1000.
+    mediatorID = 4900023
+    darkHadronIDs = [4900111, 4900211, 4900113]
+    darkHadronFinalIDs = [4900111, 4900211]
+    stableIDs = [51, 53]
+    mrho = 10.
+    mpi = 2.
+    Ns = None
+    Nf = 2
+    pvector = 0.5
+    rinv = 0.3
+
+    def metadata(self):
+        return {"mmed": self.mmed, "rinv": self.rinv}
+
+SM_IDS = [211, -211, 22, 130, 11, 13]
+
+def wrap_phi(phi):
+    return (phi+np.pi)%(2*np.pi)-np.pi
+
+# {collection}/{collection}.{field} -> counter branch name: one counter per collection, and per flat per-jet list
+def counter_name(name):
+    collection, field = name.split("/")[-1].split(".", 1)
+    return f"{collection}_{field.replace('.', '_')}_size" if field in FLAT_FIELDS else f"{collection}_size"
+
+class SyntheticDelphesSchema(DelphesSchema2):
+    def _build_collections(self, branch_forms):
+        for jet in JETS:
+            prefix = f"{jet}/{jet}."
+            # branches can be missing because of the branch filter
+            if prefix+"Constituents.refs" in branch_forms:
+                sizes = branch_forms.pop(prefix+"Constituents.fSize")
+                refs = branch_forms.pop(prefix+"Constituents.refs")
+                per_jet = listarray_form(refs["content"], transforms.counts2offsets_form(sizes["content"]))
+                branch_forms[prefix+"Constituents"] = zip_forms({"refs": {**sizes, "content": per_jet}}, prefix+"Constituents")
+            if prefix+"Tau_5" in branch_forms:
+                taus = branch_forms[prefix+"Tau_5"]["content"]
+                branch_forms[prefix+"Tau_5"] = {**branch_forms[prefix+"PT"], "content": {"class": "RegularArray", "size": 5, "content": taus, "form_key": None}}
+            if prefix+"SoftDroppedJet.fE" in branch_forms:
+                name = prefix+"SoftDroppedJet"
+                fP = zip_forms({coord: branch_forms.pop(f"{name}.fP.{coord}") for coord in ["fX", "fY", "fZ"]}, name+".fP")
+                branch_forms[name] = zip_forms({"fP": fP, "fE": branch_forms.pop(name+".fE")}, name)
+        return super()._build_collections(branch_forms)
+
+# jets with constituents around their axis, and the candidate collection they refer to (plus unclustered candidates)
+def synthetic_jets(rng, branches, jetsname, candsname, nevents, njets, nconst, pids):
+    nj = rng.poisson(njets, nevents)
+    total = int(nj.sum())
+    jet_event = np.repeat(np.arange(nevents), nj)
+    pt = rng.uniform(100, 1000, total)
+    eta = rng.normal(0, 1.5, total)
+    phi = rng.uniform(-np.pi, np.pi, total)
+    branches.update({
+        f"{jetsname}.PT": (nj, pt),
+        f"{jetsname}.Eta": (nj, eta),
+        f"{jetsname}.Phi": (nj, phi),
+        f"{jetsname}.Mass": (nj, rng.uniform(10, 300, total)),
+    })
+
+    nc = rng.poisson(nconst, total)+1
+    const_jet = np.repeat(np.arange(total), nc)
+    nclustered = len(const_jet)
+    nextra = rng.poisson(nconst, nevents)
+    cand_event = np.concatenate([jet_event[const_jet], np.repeat(np.arange(nevents), nextra)])
+    ncands = len(cand_event)
+    ids = (rng.permutation(ncands)+1).astype(np.uint32)
+    cand = {
+        "PT": np.concatenate([pt[const_jet]/nc[const_jet]*rng.exponential(1, nclustered), rng.exponential(5, ncands-nclustered)]),
+        "Eta": np.concatenate([eta[const_jet]+rng.normal(0, 0.3, nclustered), rng.normal(0, 2, ncands-nclustered)]),
+        "Phi": np.concatenate([wrap_phi(phi[const_jet]+rng.normal(0, 0.3, nclustered)), rng.uniform(-np.pi, np.pi, ncands-nclustered)]),
+        "Mass": rng.uniform(0, 1, ncands),
+        "PID": rng.choice(pids, ncands).astype(np.int32),
+        "fUniqueID": ids,
+    }
+    # candidates in random order within each event
+    order = np.lexsort((rng.random(ncands), cand_event))
+    cand_counts = np.bincount(cand_event, minlength=nevents)
+    branches.update({f"{candsname}.{field}": (cand_counts, values[order]) for field,values in cand.items()})
+
+    branches[f"{jetsname}.Constituents.fSize"] = (nj, nc.astype(np.int32))
+    branches[f"{jetsname}.Constituents.refs"] = (np.bincount(jet_event, weights=nc, minlength=nevents).astype(np.int64), ids[:nclustered])
+    return nj, pt, eta, phi
+
+# generator record with a mediator decay chain and random (but valid) mother and daughter indices
+def synthetic_gen_particles(rng, branches, helper, nevents, ngen):
+    ng = rng.poisson(ngen, nevents)+4
+    offsets = np.concatenate([[0], np.cumsum(ng)])
+    total = int(offsets[-1])
+    local = np.arange(total)-np.repeat(offsets[:-1], ng)
+    size = np.repeat(ng, ng)
+    pid = rng.choice(SM_IDS+helper.darkHadronIDs+[-helper.darkHadronIDs[1]]+helper.stableIDs, total).astype(np.int32)
+    pid[local<2] = helper.mediatorID
+    pid[local==2] = helper.darkHadronIDs[-1]
+    earlier = np.where(local>0, (rng.random(total)*local).astype(np.int32), -1)
+    later = np.where(local<size-1, local+1+(rng.random(total)*(size-local-1)).astype(np.int32), -1)
+    d1 = later.astype(np.int32)
+    # intermediate mediator, then final mediator decaying to a dark hadron
+    d1[local==0] = 1
+    d1[local==1] = 2
+    mass = np.where(pid==helper.mediatorID, rng.normal(helper.mmed, 20, total), rng.uniform(0, 20, total))
+    branches.update({
+        "GenParticle.PT": (ng, rng.exponential(20, total)),
+        "GenParticle.Eta": (ng, rng.normal(0, 2, total)),
+        "GenParticle.Phi": (ng, rng.uniform(-np.pi, np.pi, total)),
+        "GenParticle.Mass": (ng, mass),
+        "GenParticle.PID": (ng, pid),
+        "GenParticle.M1": (ng, earlier.astype(np.int32)),
+        "GenParticle.M2": (ng, np.where(rng.random(total)<0.3, earlier, -1).astype(np.int32)),
+        "GenParticle.D1": (ng, d1),
+        "GenParticle.D2": (ng, np.where(rng.random(total)<0.5, later, -1).astype(np.int32)),
+    })
+
+# branch name -> (entries per event, flat values)
+def synthetic_branches(nevents, njets, nconst, ngen, seed=0):
+    rng = np.random.default_rng(seed)
+    helper = SyntheticHelper()
+    branches = {}
+    dark_pids = helper.darkHadronFinalIDs+helper.stableIDs+SM_IDS
+    for jetsname in JETS:
+        candsname = DelphesSchema2.jet_const_pairs[jetsname]
+        nj, pt, eta, phi = synthetic_jets(rng, branches, jetsname, candsname, nevents, njets, nconst, SM_IDS if jetsname=="FatJet" else dark_pids)
+        if jetsname=="FatJet":
+            # groomed jet 4-vector and N-subjettiness
+            total = len(pt)
+            sd_pt = pt*rng.uniform(0.7, 1, total)
+            sd_m = rng.uniform(5, 150, total)
+            pz = sd_pt*np.sinh(eta)
+            for field,values in [("fP.fX", sd_pt*np.cos(phi)), ("fP.fY", sd_pt*np.sin(phi)), ("fP.fZ", pz), ("fE", np.sqrt(sd_pt**2+pz**2+sd_m**2))]:
+                branches[f"FatJet.SoftDroppedJet.{field}"] = (nj, values)
+            taus = np.sort(rng.uniform(0.01, 1, (total, 5)), axis=1)[:, ::-1]
+            branches["FatJet.Tau_5"] = (nj*5, taus.ravel())
+    synthetic_gen_particles(rng, branches, helper, nevents, ngen)
+    # one entry per event (MissingET and Event are flattened by the schema, GenMissingET is not)
+    ones = np.ones(nevents, dtype=np.int64)
+    for name in ["MissingET", "GenMissingET"]:
+        branches[f"{name}.MET"] = (ones, rng.exponential(100, nevents))
+        branches[f"{name}.Eta"] = (ones, np.zeros(nevents))
+        branches[f"{name}.Phi"] = (ones, rng.uniform(-np.pi, np.pi, nevents))
+    branches["Event.Number"] = (ones, np.arange(nevents, dtype=np.int64))
+    return branches
+
+# written in several extend() calls, so that branches have several baskets
+def write_synthetic_file(filename, branches, basket_events=1000):
+    nevents = len(next(iter(branches.values()))[0])
+    offsets = {name: np.concatenate([[0], np.cumsum(counts)]) for name,(counts,values) in branches.items()}
+    paths = {name: f"{name.split('.')[0]}/{name}" for name in branches}
+    with uproot.recreate(filename) as file:
+        file.mktree("Delphes", {paths[name]: ak.unflatten(values[:0], counts[:0]).type.content for name,(counts,values) in branches.items()}, counter_name=counter_name)
+        for start in range(0, nevents, basket_events):
+            stop = min(start+basket_events, nevents)
+            file["Delphes"].extend({
+                paths[name]: ak.unflatten(values[offsets[name][start]:offsets[name][stop]], counts[start:stop])
+                for name,(counts,values) in branches.items()
+            })
+    # constituents cached for a previous file of the same name
+    shutil.rmtree(constituents_cache_dir(filename), ignore_errors=True)
+
+# columns: as in load_events (default: the collections read by histogram()); constituents are not cached
+def load_synthetic_events(filename, with_constituents=True, columns=HIST_COLUMNS):
+    return load_events(filename, schema=SyntheticDelphesSchema, with_constituents=with_constituents, cache_constituents=False, columns=columns)
+
+# each hot path is run once (compilation, lazy reads) and then timed (best of repeat)
+def run_benchmarks(filename, repeat, fastjet_workers=1):
+    helper = SyntheticHelper()
+    results = {}
+    def timed(name, func):
+        func()
+        results[name] = best_time(func, repeat)
+        print(f"  {name:<25} {results[name]:>9.4f} s")
+
+    # all branches (the synthetic file only has those read by histogram()), materialized since columns are read lazily
+    timed("read", lambda: ak.materialize(load_synthetic_events(filename, with_constituents=False, columns=None)))
+    raw = load_synthetic_events(filename, with_constituents=False, columns=None)
+    timed("resolve_constituents", lambda: resolve_constituents(raw, JETS))
+
+    events = load_synthetic_events(filename)
+    selected, _ = select_events(events, BASE_CUTS)
+    jet12 = ak.pad_none(selected.FatJet[:,0:2], target=2, axis=1)
+    dhivjet12 = ak.pad_none(selected.DarkHadronStableJet[:,0:2], target=2, axis=1)
+    timed("selection", lambda: select_events(events, BASE_CUTS))
+    timed("calc_rinv", lambda: calc_rinv(selected, helper, {}, False))
+    timed("jet_substructure", lambda: jet_substructure(jet12))
+    timed("jet_shape", lambda: jet_shape(dhivjet12, [90,95,99]))
+    timed("recluster", lambda: recluster(ak.flatten(jet12, axis=1), KT_CUTS, N_ECF, workers=fastjet_workers))
+    columns, _ = derive_columns(events, helper, True, False, fastjet_workers=fastjet_workers)
+    timed("derive_columns", lambda: derive_columns(events, helper, True, False, fastjet_workers=fastjet_workers))
+    timed("make_histograms", lambda: make_histograms(columns, helper.mmed))
+    # everything, starting from the file: histogram() as in run_model, with the constituents resolved again each time
+    with tempfile.TemporaryDirectory() as tmpdir:
+        def histogram_file():
+            shutil.rmtree(constituents_cache_dir(filename), ignore_errors=True)
+            # without the summary printouts
+            with contextlib.redirect_stdout(io.StringIO()):
+                histogram(filename, helper, True, False, fastjet_workers=fastjet_workers, outname=os.path.join(tmpdir, "Hists.pkl"), schema=SyntheticDelphesSchema)
+        timed("histogram", histogram_file)
+    shutil.rmtree(constituents_cache_dir(filename), ignore_errors=True)
+    return results
+
+# ratio to the baseline for each benchmark; returns the names of those above their threshold
+def compare_baseline(results, baseline, config):
+    if baseline["config"]!=config:
+        print(f"Warning: baseline was measured with a different configuration: {baseline['config']}")
+    failed = []
+    print(f'  {"benchmark":<25} {"baseline s":>10} {"now s":>9} {"ratio":>6} {"limit":>6}')
+    for name,seconds in results.items():
+        if name not in baseline["results"]:
+            continue
+        ratio = seconds/baseline["results"][name]
+        limit = baseline["thresholds"][name]
+        status = "" if ratio<=limit else "  REGRESSION"
+        print(f'  {name:<25} {baseline["results"][name]:>10.4f} {seconds:>9.4f} {ratio:>6.2f} {limit:>6.2f}{status}')
+        if ratio>limit:
+            failed.append(name)
+    return failed
+
+if __name__=="__main__":
+    parser = ArgumentParser(
+        formatter_class=ArgumentDefaultsRawHelpFormatter
+    )
+    parser.add_argument("--events", type=int, default=2000, help="number of synthetic events")
+    parser.add_argument("--jets", type=float, default=4, help="mean number of jets per event (per jet collection)")
+    parser.add_argument("--constituents", type=float, default=40, help="mean number of constituents per jet")
+    parser.add_argument("--gen-particles", type=float, default=200, help="mean number of generator particles per event")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for the synthetic events")
+    parser.add_argument("--file", type=str, default=None, help="keep the synthetic ROOT file here (default: temporary file)")
+    parser.add_argument("--repeat", type=int, default=3, help="number of repetitions (fastest is reported)")
+    parser.add_argument("--fastjet-workers", type=int, default=1, help="number of local processes for fastjet reclustering")
+    parser.add_argument("--save-baseline", type=str, default=None, help="store the results as a baseline (json)")
+    parser.add_argument("--threshold", type=float, default=1.3, help="allowed ratio to the baseline time (stored with --save-baseline)")
+    parser.add_argument("--baseline", type=str, default=None, help="compare to a stored baseline (json), exit with an error if any benchmark is slower than its threshold")
+    args = parser.parse_args()
+
+    config = {"events": args.events, "jets": args.jets, "constituents": args.constituents, "gen_particles": args.gen_particles, "seed": args.seed}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = args.file if args.file is not None else os.path.join(tmpdir, "synthetic_events.root")
+        write_synthetic_file(filename, synthetic_branches(args.events, args.jets, args.constituents, args.gen_particles, args.seed))
+        print(f"Benchmarks ({filename}: {config})")
+        results = run_benchmarks(filename, args.repeat, args.fastjet_workers)
+
+    if args.save_baseline is not None:
+        with open(args.save_baseline, "w") as file:
+            json.dump({"config": config, "results": results, "thresholds": {name: args.threshold for name in results}}, file, indent=2)
+        print(f"wrote {args.save_baseline}")
+
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        failed = compare_baseline(results, baseline, config)
+        if failed:
+            sys.exit(f"Slower than the baseline: {', '.join(failed)}")
@@ -0,0 +1,95 @@
+import time
+import uproot
+from magiconfig import ArgumentParser, ArgumentDefaultsRawHelpFormatter
+from common import fast_copy_name, branch_collection
+
+# branches of the requested collections that exist in the tree
+def get_branches(tree, collections):
+    return [name for name,branch in tree.iteritems() if len(branch.branches)==0 and branch_collection(name) in collections]
+
+def basket_stats(tree, branches):
+    stats = {"baskets": 0, "compressed": 0, "uncompressed": 0}
+    for name in branches:
+        branch = tree[name]
+        stats["baskets"] += branch.num_baskets
+        for basket in range(branch.num_baskets):
+            stats["compressed"] += branch.basket_compressed_bytes(basket)
+            stats["uncompressed"] += branch.basket_uncompressed_bytes(basket)
+    return stats
+
+# best of several repetitions
+def best_time(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter()-start)
+    return min(times)
+
+# read and decompress every basket, without interpreting the contents
+def read_baskets(tree, branches):
+    for name in branches:
+        branch = tree[name]
+        for basket in range(branch.num_baskets):
+            branch.basket(basket)
+
+# full read into awkward arrays (decompression + deserialization), bypassing the array cache
+def read_arrays(tree, branches):
+    tree.arrays(branches, how=dict, array_cache=None)
+
+def benchmark_file(filename, collections, repeat):
+    results = {}
+    with uproot.open({filename : "Delphes"}) as tree:
+        for collection in collections:
+            branches = get_branches(tree, [collection])
+            if not branches:
+                continue
+            results[collection] = basket_stats(tree, branches)
+            results[collection]["basket_time"] = best_time(lambda: read_baskets(tree, branches), repeat)
+            results[collection]["array_time"] = best_time(lambda: read_arrays(tree, branches), repeat)
+    return results
+
+def print_results(filename, results):
+    print(filename)
+    print(f'  {"collection":<25} {"baskets":>8} {"compr. MB":>10} {"ratio":>6} {"basket s":>9} {"array s":>9}')
+    for collection,stats in results.items():
+        ratio = stats["uncompressed"]/max(stats["compressed"],1)
+        print(f'  {collection:<25} {stats["baskets"]:>8} {stats["compressed"]/1e6:>10.2f} {ratio:>6.2f} {stats["basket_time"]:>9.3f} {stats["array_time"]:>9.3f}')
+
+def benchmark(filename, collections, repeat):
+    fastname = fast_copy_name(filename)
+    results = benchmark_file(filename, collections, repeat)
+    print_results(filename, results)
+    try:
+        fast_results = benchmark_file(fastname, collections, repeat)
+    except FileNotFoundError:
+        print(f"No read-optimized copy found ({fastname}): create it with run_model --steps fastcopy")
+        return
+    print_results(fastname, fast_results)
+
+    print("Speedup (basket read, array read):")
+    for collection,stats in fast_results.items():
+        if collection not in results:
+            continue
+        print(f'  {collection:<25} {results[collection]["basket_time"]/stats["basket_time"]:>6.2f}x {results[collection]["array_time"]/stats["array_time"]:>6.2f}x')
+
+if __name__=="__main__":
+    collections_default = [
+        "ParticleFlowCandidate",
+        "GenParticle",
+        "GenCandidate",
+        "GenStableCandidate",
+        "DarkHadronCandidate",
+        "FatJet",
+        "DarkHadronJet",
+    ]
+
+    parser = ArgumentParser(
+        formatter_class=ArgumentDefaultsRawHelpFormatter
+    )
+    parser.add_argument("file", type=str, help="Delphes output file (compared to its read-optimized copy, if present)")
+    parser.add_argument("--collections", type=str, default=collections_default, nargs='*', help="collections to read")
+    parser.add_argument("--repeat", type=int, default=3, help="number of repetitions (fastest is reported)")
+    args = parser.parse_args()
+
+    benchmark(args.file, args.collections, args.repeat)
@@ -1,71 +1,152 @@
+import os
+import ast
+import time
+import shutil
 import awkward as ak
 import pickle
 import numpy as np
+import numba as nb
 import hist
 import matplotlib as mpl
 from coffea.nanoevents import NanoEventsFactory
-from common import load_events
-from collections import defaultdict
-from itertools import chain
-from scipy.stats import sem
+from common import load_events, io_report, print_io_report, DelphesSchema2, counts_to_offsets, JET_AXIS, PROFILER
+from collections import defaultdict, namedtuple
+from functools import lru_cache
+from glob import glob
 import fastjet
 
 def ET(vec):
     return np.sqrt(vec.px**2+vec.py**2+vec.mass**2)
 
-def deltaR(jet):
-    return jet.deltaR(jet.Constituents)
-
-def calculate_girth(jet):
-    particle_dR = deltaR(jet)
-    girth = ak.sum(jet.Constituents.pt * particle_dR, axis=-1)
-    girth = np.divide(girth,jet.pt) #normalize wrt jet pt
-    return girth
-
-def calculate_ptD(jet):
-    sum_pt = ak.sum(jet.Constituents.pt,axis=-1)
-    sum_pt2 = ak.sum(jet.Constituents.pt ** 2,axis=-1)
-    ptD = np.sqrt(sum_pt2) / sum_pt
-
-    # Return the result (ptD)
-    return ptD
-
-def calc_axis1_axis2(jet):
-    jet_constpt = jet.Constituents.pt
-    deta_particle = np.abs(jet.eta-jet.Constituents.eta)
-    dphi_particle = np.abs(jet.deltaphi(jet.Constituents))
-
-    # Calculate weights (pt^2) for each constituent
-    weights_pt = jet_constpt**2
-
-    # Calculate weighted sums for each event
-    sum_weight = ak.sum(weights_pt, axis=1)  # Sum of weights (pt^2) for each event
-
-    sum_deta = ak.sum(deta_particle * weights_pt, axis=1)
-    sum_dphi = ak.sum(dphi_particle * weights_pt, axis=1)
-    sum_deta2 = ak.sum(deta_particle**2 * weights_pt, axis=1)
-    sum_dphi2 = ak.sum(dphi_particle**2 * weights_pt, axis=1)
-    sum_detadphi = ak.sum(deta_particle * dphi_particle * weights_pt, axis=1)
-
-    # Calculate averages
-    ave_deta = sum_deta / sum_weight
-    ave_dphi = sum_dphi / sum_weight
-    ave_deta2 = sum_deta2 / sum_weight
-    ave_dphi2 = sum_dphi2 / sum_weight
-
-    # Calculate covariance matrix components
-    a = ave_deta2 - ave_deta**2
-    b = ave_dphi2 - ave_dphi**2
-    c = -(sum_detadphi / sum_weight - ave_deta * ave_dphi)
-
-    # Calculate the discriminant (delta) for each event
-    delta = np.sqrt(np.abs((a - b)**2 + 4 * c**2))
-
-    # Calculate axis1 (major) and axis2 (minor) for each event
-    axis1 = np.sqrt(0.5 * (a + b + delta))
-    axis2 = np.sqrt(0.5 * (a + b - delta))
+# per-jet substructure from flat constituent pt/eta/phi, in one pass over the constituents of each jet
+# offsets: constituent offsets of the jets; returns girth, ptD, axis1 (major), axis2 (minor)
+@nb.njit(nogil=True, error_model="numpy")
+def substructure_kernel(jet_pt, jet_eta, jet_phi, offsets, pt, eta, phi):
+    njets = len(jet_pt)
+    girth = np.empty(njets)
+    ptD = np.empty(njets)
+    axis1 = np.empty(njets)
+    axis2 = np.empty(njets)
+    for ijet in range(njets):
+        sum_pt = 0.
+        sum_pt2 = 0.
+        sum_ptdr = 0.
+        sum_deta = 0.
+        sum_dphi = 0.
+        sum_deta2 = 0.
+        sum_dphi2 = 0.
+        sum_detadphi = 0.
+        for iconst in range(offsets[ijet], offsets[ijet+1]):
+            deta = jet_eta[ijet] - eta[iconst]
+            dphi = (jet_phi[ijet] - phi[iconst] + np.pi) % (2*np.pi) - np.pi
+            dr = np.sqrt(dphi**2 + deta**2)
+            deta = np.abs(deta)
+            dphi = np.abs(dphi)
+            # weights (pt^2) for axes
+            weight = pt[iconst]**2
+            sum_pt += pt[iconst]
+            sum_pt2 += weight
+            sum_ptdr += pt[iconst]*dr
+            sum_deta += deta*weight
+            sum_dphi += dphi*weight
+            sum_deta2 += deta**2*weight
+            sum_dphi2 += dphi**2*weight
+            sum_detadphi += deta*dphi*weight
+        # normalize wrt jet pt
+        girth[ijet] = sum_ptdr/jet_pt[ijet]
+        ptD[ijet] = np.sqrt(sum_pt2)/sum_pt
+
+        # averages
+        ave_deta = sum_deta/sum_pt2
+        ave_dphi = sum_dphi/sum_pt2
+        ave_deta2 = sum_deta2/sum_pt2
+        ave_dphi2 = sum_dphi2/sum_pt2
+        # covariance matrix components
+        a = ave_deta2 - ave_deta**2
+        b = ave_dphi2 - ave_dphi**2
+        c = -(sum_detadphi/sum_pt2 - ave_deta*ave_dphi)
+        # discriminant
+        delta = np.sqrt(np.abs((a - b)**2 + 4*c**2))
+        axis1[ijet] = np.sqrt(0.5*(a + b + delta))
+        axis2[ijet] = np.sqrt(0.5*(a + b - delta))
+    return girth, ptD, axis1, axis2
+
+# per-jet values back into the (event, jet) structure of jets, with None for missing jets (and for invalid values, if given)
+def unflatten_jets(values, jets, valid=None):
+    is_jet = ak.to_numpy(ak.flatten(~ak.is_none(jets, axis=1)))
+    index = np.full(len(is_jet), -1, dtype=np.int64)
+    index[is_jet] = np.arange(np.count_nonzero(is_jet))
+    if valid is not None:
+        index[is_jet] = np.where(valid, index[is_jet], -1)
+    layout = ak.contents.IndexedOptionArray(ak.index.Index64(index), ak.contents.NumpyArray(values))
+    return ak.unflatten(ak.Array(layout), ak.num(jets, axis=1))
+
+# flat quantities of the jets that are present and of their constituents, with the constituent offsets of each jet
+def flatten_jets(jets):
+    present = jets[~ak.is_none(jets, axis=1)]
+    nconst = ak.to_numpy(ak.flatten(ak.num(present.Constituents, axis=2)))
+    offsets = counts_to_offsets(nconst)
+    def flat(array):
+        return ak.to_numpy(ak.flatten(array, axis=None)).astype(np.float64)
+    return {
+        "nconst": nconst,
+        "offsets": offsets,
+        "jet": {var:flat(present[var]) for var in ["pt", "eta", "phi"]},
+        "const": {var:flat(present.Constituents[var]) for var in ["pt", "eta", "phi"]},
+    }
 
-    return axis1, axis2
+# girth, ptD, major/minor axes, and number of constituents for jets (event, jet), possibly padded with None
+def jet_substructure(jets, flat=None):
+    if flat is None:
+        flat = flatten_jets(jets)
+    results = substructure_kernel(
+        flat["jet"]["pt"], flat["jet"]["eta"], flat["jet"]["phi"], flat["offsets"],
+        flat["const"]["pt"], flat["const"]["eta"], flat["const"]["phi"],
+    )
+    return {name:unflatten_jets(values, jets) for name,values in zip(["girth", "ptD", "axis1", "axis2", "nconst"], results + (flat["nconst"],))}
+
+# constituents of each jet sorted once by DeltaR from the jet axis, so all fractions come from one pass;
+# returns, per jet, the DeltaR containing each fraction of the scalar sum of constituent pT ("jet shape")
+@nb.njit(nogil=True, error_model="numpy")
+def jet_shape_kernel(jet_eta, jet_phi, offsets, pt, eta, phi, fractions):
+    njets = len(jet_eta)
+    radii = np.full((njets, len(fractions)), np.nan)
+    for ijet in range(njets):
+        start = offsets[ijet]
+        stop = offsets[ijet+1]
+        if stop==start:
+            continue
+        deta = jet_eta[ijet] - eta[start:stop]
+        dphi = (jet_phi[ijet] - phi[start:stop] + np.pi) % (2*np.pi) - np.pi
+        dr = np.sqrt(dphi**2 + deta**2)
+        order = np.argsort(dr, kind="mergesort")
+        cumul = np.cumsum(pt[start:stop][order])
+        # last element of sum is total from all constituents
+        total = cumul[-1]
+        ifrac = 0
+        for iconst in range(len(order)):
+            while ifrac<len(fractions) and cumul[iconst] >= fractions[ifrac]*total:
+                radii[ijet, ifrac] = dr[order[iconst]]
+                ifrac += 1
+    return radii
+
+# jet shape for jets (event, jet), possibly padded with None
+# returns {"radius": {pct: DeltaR containing pct% of the constituent pT}}
+def jet_shape(jets, pcts, flat=None):
+    if flat is None:
+        flat = flatten_jets(jets)
+    # fractions must be in increasing order
+    pcts = sorted(pcts)
+    radii = jet_shape_kernel(
+        flat["jet"]["eta"], flat["jet"]["phi"], flat["offsets"],
+        flat["const"]["pt"], flat["const"]["eta"], flat["const"]["phi"],
+        np.array([pct/100 for pct in pcts]),
+    )
+    # jets without constituents have no radius
+    has_const = flat["nconst"]>0
+    return {
+        "radius": {pct:unflatten_jets(radii[:, ipct].copy(), jets, has_const) for ipct,pct in enumerate(pcts)},
+    }
 
 def getTau(events):
     # we have tau1 to tau5
@@ -74,26 +155,92 @@ def getTau(events):
         if i != 1: events[f"Jet12_tau{i}{i-1}"] = events[f"Jet12_tau{i}"] / events[f"Jet12_tau{i-1}"]
     return events
 
-def fj_cluster_sequence(jets):
+# constituent 4-vectors of a flat list of jets, reduced to what fastjet needs: flat px/py/pz/E buffers + per-jet offsets
+def slim_constituents(jets):
+    const = jets.Constituents
+    flat = ak.flatten(const, axis=1)
+    slim = {c: np.ascontiguousarray(ak.to_numpy(getattr(flat, c)), dtype=np.float64) for c in ("px", "py", "pz", "E")}
+    slim["offsets"] = counts_to_offsets(ak.to_numpy(ak.num(const, axis=1)))
+    return slim
+
+# recluster one batch of jets (module-level so that it can run in a worker process):
+# one cluster sequence and one set of Lund declusterings per batch, reused for all kt cuts and ECFs
+def recluster_batch(px, py, pz, E, offsets, kt_cuts, n_ecf):
+    const = ak.zip({"px": px, "py": py, "pz": pz, "E": E})
+    const = ak.Array(ak.contents.ListOffsetArray(ak.index.Index64(offsets - offsets[0]), const.layout))
     # Re-cluster the constituents with Cambridge/Aachen.
     # Using a very large R guarantees a single C/A jet containing all constituents
     jet_def = fastjet.JetDefinition(fastjet.cambridge_algorithm, 1000.0)
-    cs = fastjet.ClusterSequence(jets.Constituents, jet_def)
-    return cs
-
-def getLundMultiplicity(cluster_seq, kt = 1):
-    # Retrieve the primary Lund-plane declusterings for the single jet and apply kt cut
-    lund = cluster_seq.exclusive_jets_lund_declusterings(njets=1)
-    kt_values = ak.flatten(lund)[:]["kt"]
-    mult = ak.sum(kt_values > kt, axis=-1)
-    return mult
-
-def getECF(cluster_seq, npointECF):
-    ecf = cluster_seq.exclusive_jets_energy_correlator(njets=1, npoint=npointECF, beta=1)
-    return ecf
+    cs = fastjet.ClusterSequence(const, jet_def)
+    kt_values = ak.flatten(cs.exclusive_jets_lund_declusterings(njets=1))["kt"]
+    result = {f"lundMult{k}": ak.to_numpy(ak.sum(kt_values > k, axis=-1)) for k in kt_cuts}
+    for n in n_ecf:
+        result[f"ECF{n}"] = ak.to_numpy(cs.exclusive_jets_energy_correlator(njets=1, npoint=n, beta=1))
+    return result
+
+# Lund multiplicities and ECFs for a flat list of jets, reclustered in batches of at most batch_size jets
+# (bounds the memory of each cluster sequence), optionally spread over worker processes; results are in jet order
+def recluster(jets, kt_cuts, n_ecf, batch_size=2000, workers=1):
+    slim = slim_constituents(jets)
+    offsets = slim["offsets"]
+    njets = len(offsets)-1
+    batches = []
+    for start in range(0, njets, batch_size):
+        stop = min(start+batch_size, njets)
+        cstart, cstop = offsets[start], offsets[stop]
+        batches.append([slim[c][cstart:cstop] for c in ("px", "py", "pz", "E")] + [offsets[start:stop+1]])
+    names = [f"lundMult{k}" for k in kt_cuts] + [f"ECF{n}" for n in n_ecf]
+    if not batches:
+        return {name: np.zeros(0) for name in names}
+    if workers>1 and len(batches)>1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=min(workers, len(batches))) as executor:
+            results = list(executor.map(recluster_batch, *zip(*batches), [kt_cuts]*len(batches), [n_ecf]*len(batches)))
+    else:
+        results = [recluster_batch(*batch, kt_cuts, n_ecf) for batch in batches]
+    return {name: np.concatenate([result[name] for result in results]) for name in names}
+
+# |PID| in a list of IDs, in one pass over the flat PID buffer (numpy or awkward arrays of any structure)
+def pid_in(pid, ids):
+    ids = np.asarray(ids)
+    if isinstance(pid, np.ndarray):
+        return np.isin(np.abs(pid), ids)
+    def apply(layout, **kwargs):
+        if layout.is_numpy:
+            return ak.contents.NumpyArray(np.isin(np.abs(layout.data), ids))
+    return ak.transform(apply, pid)
+
+# flags of each mother (is dark, daughter 1 is SM, daughter 2 is SM) for one particle
+@nb.njit(nogil=True)
+def mother_flags(mother, start, d1, d2, is_dark):
+    if mother==-1:
+        return False, False, False
+    imother = start+mother
+    d1_sm = d1[imother]!=-1 and not is_dark[start+d1[imother]]
+    d2_sm = d2[imother]!=-1 and not is_dark[start+d2[imother]]
+    return is_dark[imother], d1_sm, d2_sm
+
+# mother/daughter flags for all gen particles in one traversal
+# m1, m2, d1, d2: local (per-event) indices, -1 if none
+# returns flags (m1_dark, m1_d1_sm, m1_d2_sm, m2_dark, m2_d1_sm, m2_d2_sm) and whether the first daughter is stable (or absent)
+@nb.njit(nogil=True)
+def dark_ancestry_kernel(offsets, m1, m2, d1, d2, is_dark, is_stable):
+    flags = np.zeros((6, len(m1)), dtype=np.bool_)
+    stable_daughter = np.zeros(len(m1), dtype=np.bool_)
+    for iev in range(len(offsets)-1):
+        start = offsets[iev]
+        for i in range(start, offsets[iev+1]):
+            flags[0, i], flags[1, i], flags[2, i] = mother_flags(m1[i], start, d1, d2, is_dark)
+            flags[3, i], flags[4, i], flags[5, i] = mother_flags(m2[i], start, d1, d2, is_dark)
+            stable_daughter[i] = d1[i]==-1 or is_stable[start+d1[i]]
+    return flags, stable_daughter
 
 def calc_rinv(events, helper, meta_dict, debug):
     pid = events.GenParticle["PID"]
+    counts = ak.to_numpy(ak.num(pid))
+    offsets = counts_to_offsets(counts)
+    def flat(array):
+        return ak.to_numpy(ak.flatten(array))
 
     def dprint(*args):
         if debug:
@@ -107,21 +254,21 @@ def calc_rinv(events, helper, meta_dict, debug):
     stable_particle_ids = helper.stableIDs
     dprint('stable_particle_ids',stable_particle_ids)
 
+    # flat arrays -> per event
+    def unflat(array):
+        return ak.unflatten(array, counts)
+
     def printer(name, arr):
-        dprint(f'{name:<30}',ak.sum(arr, axis=1).to_numpy().tolist())
+        if debug:
+            dprint(f'{name:<30}',ak.sum(unflat(arr), axis=1).to_numpy().tolist())
 
     # Boolean array of whether a particle is dark
-    is_dark = ak.zeros_like(pid)
-    for dhid in dark_hadron_ids:
-        is_dark = is_dark | (np.abs(pid)==dhid)
-    is_dark = is_dark==1
+    flat_pid = flat(pid)
+    is_dark = pid_in(flat_pid, dark_hadron_ids)
     printer('is_dark',is_dark)
 
     # Boolean array of whether a particle is dark
-    is_dark_final = ak.zeros_like(pid)
-    for dhid in dark_hadron_final_ids:
-        is_dark_final = is_dark_final | (np.abs(pid)==dhid)
-    is_dark_final = is_dark_final==1
+    is_dark_final = pid_in(flat_pid, dark_hadron_final_ids)
     printer('is_dark_final',is_dark_final)
 
     # exclude dark hadrons resulting from mixed decay of another dark hadron
@@ -129,46 +276,38 @@ def calc_rinv(events, helper, meta_dict, debug):
     m2 = events.GenParticle["M2"]
     d1 = events.GenParticle["D1"]
     d2 = events.GenParticle["D2"]
+    flags, stable_daughter = dark_ancestry_kernel(offsets, flat(m1), flat(m2), flat(d1), flat(d2), is_dark, pid_in(flat_pid, stable_particle_ids))
+    m1_dark, m1_d1_sm, m1_d2_sm, m2_dark, m2_d1_sm, m2_d2_sm = flags
 
-    m1_dark = (m1!=-1) & (is_dark[m1])
-    m1_d1_sm = (d1[m1]!=-1) & (~is_dark[d1[m1]])
-    m1_d2_sm = (d2[m1]!=-1) & (~is_dark[d2[m1]])
-    m2_dark = (m2!=-1) & (is_dark[m2])
-    m2_d1_sm = (d1[m2]!=-1) & (~is_dark[d1[m2]])
-    m2_d2_sm = (d2[m2]!=-1) & (~is_dark[d2[m2]])
-
-    def make_table(mask):
-        table = ak.zip({
+    # for debugging, show only dark hadron entries
+    if debug:
+        mask = unflat(is_dark)
+        table_debug = ak.zip({
             "index": ak.local_index(pid)[mask],
             "pid": pid[mask],
-            "final": is_dark_final[mask],
+            "final": unflat(is_dark_final)[mask],
             "i_m1": m1[mask],
             "m1": pid[m1[mask]],
-            "m1_dark": m1_dark[mask],
+            "m1_dark": unflat(m1_dark)[mask],
             "m1_d1": pid[d1[m1[mask]]],
-            "m1_d1_sm": m1_d1_sm[mask],
+            "m1_d1_sm": unflat(m1_d1_sm)[mask],
             "m1_d2": pid[d2[m1[mask]]],
-            "m1_d2_sm": m1_d2_sm[mask],
+            "m1_d2_sm": unflat(m1_d2_sm)[mask],
             "i_m2": m2[mask],
             "m2": pid[m2[mask]],
-            "m2_dark": m2_dark[mask],
+            "m2_dark": unflat(m2_dark)[mask],
             "m2_d1": pid[d1[m2[mask]]],
-            "m2_d1_sm": m2_d1_sm[mask],
+            "m2_d1_sm": unflat(m2_d1_sm)[mask],
             "m2_d2": pid[d2[m2[mask]]],
-            "m2_d2_sm": m2_d2_sm[mask],
+            "m2_d2_sm": unflat(m2_d2_sm)[mask],
             "i_d1": d1[mask],
             "d1": pid[d1[mask]],
             "i_d2": d2[mask],
             "d2": pid[d2[mask]],
         })
-        return table
-
-    # for debugging, show only dark hadron entries
-    if debug:
-        table_debug = make_table(mask=is_dark)
         import pandas as pd
         with pd.option_context('display.max_columns', None, 'display.max_rows', None, 'display.width', None, 'display.max_colwidth', None):
-            dprint(ak.to_pandas(table_debug))
+            dprint(ak.to_dataframe(table_debug))
 
     m1_dark_d_sm = m1_dark & (m1_d1_sm | m1_d2_sm)
     m2_dark_d_sm = m2_dark & (m2_d1_sm | m2_d2_sm)
@@ -181,12 +320,11 @@ def calc_rinv(events, helper, meta_dict, debug):
                      ('m2_dark_d2_sm',m2_dark & m2_d2_sm),
                      ('m2_dark_d1_d2_sm',m2_dark_d_sm)]:
         printer(name,arr)
-    dark_mother_sm_sibling = (m1_dark_d_sm) | (m2_dark_d_sm)
-    dark_mother_sm_sibling = dark_mother_sm_sibling==1
+    dark_mother_sm_sibling = m1_dark_d_sm | m2_dark_d_sm
     printer('dark_mother_sm_sibling',dark_mother_sm_sibling)
 
     # quick diversion here to measure alpha = E_pi / m_rho for 3-body decays
-    is_dark_3body = is_dark_final & dark_mother_sm_sibling
+    is_dark_3body = unflat(is_dark_final & dark_mother_sm_sibling)
     pi_3body = events.GenParticle[is_dark_3body]
     rho_3body = events.GenParticle[m1[is_dark_3body]]
     pi_3body_restframe = pi_3body.boostCM_of_beta3(rho_3body.to_beta3())
@@ -194,29 +332,21 @@ def calc_rinv(events, helper, meta_dict, debug):
     m_rho_3body = rho_3body.mass
     alpha_3body = E_pi_3body/m_rho_3body
     meta_dict["alpha_3body"] = fill_stats(alpha_3body)
-    print(f"Average alpha_3body = {meta_dict['alpha_3body']['mean']:.3} ({meta_dict['alpha_3body']['stdev']:.3})")
     events["alpha_3body"] = alpha_3body
 
     is_dark_final = is_dark_final & ~dark_mother_sm_sibling
     printer('is_dark_final',is_dark_final)
 
-    # PIDs of dark daughter
-    dark_final_daughter = pid[d1[is_dark_final]]
-    is_dark_final_daughter = ak.zeros_like(dark_final_daughter) | (d1[is_dark_final]==-1)
+    # dark hadrons whose (first) daughter is stable, or that have no daughter
+    is_dark_final_daughter = is_dark_final & stable_daughter
     printer('is_dark_final_daughter',is_dark_final_daughter)
 
-    for dsid in stable_particle_ids:
-        printer(f'dark_final_daughter=={dsid}', (np.abs(dark_final_daughter)==dsid))
-        is_dark_final_daughter = is_dark_final_daughter | (np.abs(dark_final_daughter)==dsid)
-    printer('is_dark_final_daughter',is_dark_final_daughter)
-
-    numer = ak.sum(is_dark_final_daughter, axis=1).to_numpy()
-    denom = ak.sum(is_dark_final, axis=1).to_numpy()
+    numer = ak.sum(unflat(is_dark_final_daughter), axis=1).to_numpy()
+    denom = ak.sum(unflat(is_dark_final), axis=1).to_numpy()
     with np.errstate(divide='ignore', invalid='ignore'):
         stable_invisible_fraction = np.where(denom>0, numer/denom, 0)
     dprint('stable_invisible_fraction',stable_invisible_fraction.tolist())
     meta_dict["stable_invisible_fraction"] = fill_stats(stable_invisible_fraction)
-    print(f"Average computed rinv value (pions) = {meta_dict['stable_invisible_fraction']['mean']:.5} ({meta_dict['stable_invisible_fraction']['stdev']:.5})")
 
     events["stable_invisible_fraction"] = stable_invisible_fraction
 
@@ -231,46 +361,280 @@ def calc_mt(jet, met):
 def proj(events, jet, const):
     return events[jet, const].dot(events[jet]) / events[jet].mass
 
-def jet_const_cumsum(array):
-    counts = ak.num(array, axis=-1)
-    flat_counts = ak.flatten(counts, axis=None)
-    flat_array = ak.flatten(array, axis=None)
-    global_cumsum = np.cumsum(flat_array)
-    offsets = np.zeros(len(flat_counts)+1, dtype=int)
-    offsets[1:] = np.cumsum(flat_counts)
-    start_sums = np.zeros_like(global_cumsum)
-    prev_tot = np.zeros(len(flat_counts))
-    prev_tot[1:] = global_cumsum[offsets[1:-1]-1]
-    subtractions = np.repeat(prev_tot, flat_counts)
-    # unflatten in two stages
-    per_jet_flat = global_cumsum - subtractions
-    jets_unflat = ak.unflatten(per_jet_flat, flat_counts)
-    return ak.unflatten(jets_unflat, ak.num(counts, axis=1))
-
-def fill_stats(array):
-    nparray = ak.to_numpy(ak.drop_none(ak.nan_to_none(ak.flatten(array, axis=None))))
-    return {
-        "N": len(nparray),
-        "mean": np.mean(nparray),
-        "stdev": np.std(nparray),
-        "stderr": sem(nparray),
-    }
+# mergeable summary statistics of a quantity, updated batch by batch (only one batch in memory at a time):
+# count, mean, and variance (pairwise update of Chan et al.), min, max
+class StatsAccumulator:
+    def __init__(self):
+        self.N = 0
+        self.mean = 0.
+        # sum of squared deviations from the mean
+        self.m2 = 0.
+        self.min = np.inf
+        self.max = -np.inf
+
+    # NaN and None entries are skipped
+    def update(self, array):
+        values = ak.to_numpy(ak.drop_none(ak.nan_to_none(ak.flatten(array, axis=None))))
+        if len(values)==0:
+            return self
+        mean = np.mean(values)
+        self.combine(len(values), mean, np.sum((values-mean)**2), np.min(values), np.max(values))
+        return self
+
+    # stats from a disjoint set of entries (e.g. another entry range or another file)
+    def merge(self, other):
+        self.combine(other.N, other.mean, other.m2, other.min, other.max)
+        return self
+
+    def combine(self, N, mean, m2, vmin, vmax):
+        if N==0:
+            return
+        if self.N==0:
+            self.N, self.mean, self.m2 = N, mean, m2
+        else:
+            total = self.N+N
+            delta = mean-self.mean
+            self.mean += delta*N/total
+            self.m2 += m2 + delta**2*self.N*N/total
+            self.N = total
+        self.min = min(self.min, vmin)
+        self.max = max(self.max, vmax)
+
+    # summary stored in the output (stdev: population, stderr: from the sample variance, as scipy.stats.sem)
+    def result(self):
+        N = self.N
+        return {
+            "N": N,
+            "mean": self.mean if N>0 else np.nan,
+            "stdev": np.sqrt(self.m2/N) if N>0 else np.nan,
+            "stderr": np.sqrt(self.m2/(N-1))/np.sqrt(N) if N>1 else np.nan,
+            "min": self.min if N>0 else np.nan,
+            "max": self.max if N>0 else np.nan,
+        }
+
+# ratio of sums over all events (e.g. global rinv), mergeable by summing numerator and denominator
+class RatioAccumulator:
+    def __init__(self):
+        self.numer = 0
+        self.denom = 0
+
+    def update(self, numer, denom):
+        self.numer += numer
+        self.denom += denom
+        return self
+
+    def merge(self, other):
+        return self.update(other.numer, other.denom)
+
+    def result(self):
+        return {"N": 1, "mean": self.numer/self.denom, "stdev": 0, "stderr": 0, "numer": self.numer, "denom": self.denom}
+
+def fill_stats(array, **kwargs):
+    return StatsAccumulator(**kwargs).update(array)
+
+def fill_global_stats(numer, denom):
+    return RatioAccumulator().update(numer, denom)
+
+# meta_dict values are accumulators until the end of histogram(), where they are replaced by their results
+def merge_meta(meta_dict, meta_dict_chunk):
+    for key,stats in meta_dict_chunk.items():
+        meta_dict[key] = meta_dict[key].merge(stats) if key in meta_dict else stats
+
+# accumulator with the state of a stored result (e.g. to add events to an existing output)
+def accumulator_from_result(result):
+    if "all" in result:
+        cutflow = CutflowAccumulator(result["all"]["N"])
+        for name,cut in result.items():
+            if name!="all":
+                cutflow.add(name, cut["N"], cut["time"])
+        return cutflow
+    if "numer" in result:
+        return RatioAccumulator().update(result["numer"], result["denom"])
+    stats = StatsAccumulator()
+    if result["N"]>0:
+        stats.combine(result["N"], result["mean"], result["stdev"]**2*result["N"], result["min"], result["max"])
+    return stats
+
+def merge_hists(hist_dict, hist_dict_chunk):
+    for key,h in hist_dict_chunk.items():
+        hist_dict[key] = hist_dict[key] + h if key in hist_dict else h
+
+def merge_io(io_dict, io_dict_chunk):
+    for branch,nbytes in io_dict_chunk.items():
+        if branch not in io_dict:
+            io_dict[branch] = {"compressed": 0, "uncompressed": 0}
+        for key,val in nbytes.items():
+            io_dict[branch][key] += val
+
+# combine the output of a disjoint set of events of the same model (e.g. a batch of added events) into output
+def merge_outputs(output, other):
+    # checked before anything is changed, e.g. for outputs made by an older version (per-jet histograms, stats without min/max)
+    hists, other_hists = output["hist"], other["hist"]
+    if hists and other_hists and set(hists)!=set(other_hists):
+        raise ValueError("Cannot merge outputs with different histograms (made with different code or histogram groups)")
+    for key in set(hists) & set(other_hists):
+        if hists[key].axes!=other_hists[key].axes:
+            raise ValueError(f"Cannot merge outputs with different axes for histogram {key}")
+    def accumulators(analysis):
+        try:
+            return {key: accumulator_from_result(result) for key,result in analysis.items()}
+        except KeyError as e:
+            raise ValueError(f"Cannot merge outputs: stats are missing {e} (made with different code)") from e
+    meta_dict = accumulators(output["analysis"])
+    merge_meta(meta_dict, accumulators(other["analysis"]))
+
+    merge_hists(hists, other_hists)
+    output["analysis"] = {key: stats.result() for key,stats in meta_dict.items()}
+    io_dict = output.get("io", {})
+    merge_io(io_dict, other.get("io", {}))
+    output["io"] = dict(sorted(io_dict.items(), key=lambda item: item[1]["compressed"], reverse=True))
+    # the profile only describes the processing of one set of events
+    output.pop("profile", None)
+    return output
+
+def load_output(filename="Hists.pkl"):
+    with open(filename, "rb") as infile:
+        return pickle.load(infile)
+
+def save_output(output, filename="Hists.pkl"):
+    with open(filename, "wb") as out:
+        pickle.dump(output, out)
+
+# alternative 3body rinv calculation using alpha measured from Pythia
+def add_rinv_3body_gen(output, helper):
+    # not defined if no events passed the selection
+    if output["analysis"].get("alpha_3body", {}).get("N", 0)==0:
+        return
+    if helper.mrho < 2*helper.mpi:
+        from svjHelper import fcdc_rinv_3body, fcdc_rinv_3body_simp
+        if helper.Ns is not None:
+            output["model"]['rinv_3body_gen'] = fcdc_rinv_3body(Nf=helper.Nf, Ns=helper.Ns, mrho=helper.mrho, mpi=helper.mpi, pvector=helper.pvector, alpha=output["analysis"]['alpha_3body']['mean'])
+        else:
+            output["model"]['rinv_3body_gen'] = fcdc_rinv_3body_simp(rinv=helper.rinv, Nf=helper.Nf, mrho=helper.mrho, mpi=helper.mpi, pvector=helper.pvector, alpha=output["analysis"]['alpha_3body']['mean'])
 
-def histogram(filename, helper, with_constituents=True, debug=False):
-    events = load_events(filename, with_constituents=with_constituents)
+def print_summary(output, with_constituents):
+    meta_dict = output["analysis"]
+    def mean_stdev(name, fmt):
+        return f"{meta_dict[name]['mean']:{fmt}} ({meta_dict[name]['stdev']:{fmt}})"
+    jet_ind_keys = ["1","2","12"]
 
-    # output dictionary with histograms and metadata
-    output = {}
-    output["model"] = helper.metadata()
-    meta_dict = {}
+    print("Cutflow:")
+    for name,cut in meta_dict["cutflow"].items():
+        print(f"  {name:<40} {cut['N']:>8} ({cut['time']:.2f} s)")
+    print(f"Predicted rinv = {output['model'].get('rinv_3body', output.get('rinvpred_3body', output['model'].get('rinv',output['model'].get('rinvpred', -1)))):.5}")
+    print(f"Average alpha_3body = {mean_stdev('alpha_3body', '.3')}")
+    print(f"Average computed rinv value (pions) = {mean_stdev('stable_invisible_fraction', '.5')}")
+    # dark jet stats are only filled with constituents and the darkjets group
+    if not with_constituents or "DiDHIVJet_rinv_proj" not in meta_dict:
+        return
+    for suff in ["proj", "shape"]:
+        print(f"Average jet-level rinv ({suff}) =", ", ".join([mean_stdev(f"DHIVJet{key}_rinv_{suff}", ".5") for key in jet_ind_keys]))
+        print(f"Average dijet-level rinv ({suff}) =", mean_stdev(f"DiDHIVJet_rinv_{suff}", ".5"))
+        print(f"Global jet-level rinv ({suff}) =", f"{meta_dict[f'DHIVJet12_rinv_{suff}_global']['mean']:.5}")
+    for pre in ["DH", "DHV", "DHIV"]:
+        print(f"\n{pre}Jet")
+        for pct in [90,95,99]:
+            print(f"{pct}% radius (jet shape):", ", ".join([mean_stdev(f"{pre}Jet{key}_radius{pct}", ".2") for key in jet_ind_keys]))
+
+# collections and fields read by histogram() (schema kinematics and constituent references are added by load_events)
+HIST_COLUMNS = {
+    "Event": ["Number"],
+    "FatJet": ["SoftDroppedJet", "Tau_5"],
+    "MissingET": [],
+    "GenMissingET": [],
+    "GenParticle": ["PID", "M1", "M2", "D1", "D2"],
+    "DarkHadronJet": [],
+    "DarkHadronVisibleJet": [],
+    "DarkHadronStableJet": [],
+    "GenStableCandidate": ["PID"],
+}
+
+# collections read by histogram(), including the candidates that jet constituents refer to
+def hist_collections(with_constituents=True):
+    collections = list(HIST_COLUMNS)
+    if with_constituents:
+        collections.extend(const for jet,const in DelphesSchema2.jet_const_pairs.items() if jet in HIST_COLUMNS and const not in collections)
+    return collections
 
+# event selection: (name, expression) pairs; each expression is evaluated on the events passing the previous cuts
+# (names: events, ak, np) and gives a boolean mask (None counts as failing); extra cuts (e.g. from the command line) are appended
+BASE_CUTS = [
     # require two jets
-    mask = ak.num(events.FatJet)>=2
-    events = events[mask]
-
-    #get rid of None Events
-    mask2 = ~ak.is_none(events.Event.Number)
-    events = events[mask2]
+    ("two_fatjets", "ak.num(events.FatJet)>=2"),
+    # get rid of None Events
+    ("event_number", "~ak.is_none(events.Event.Number)"),
+]
+
+# cuts are restricted to expressions of events, ak, np: no other names, no private attributes (e.g. __class__),
+# no lambdas, comprehensions, or assignments, so that --cuts cannot run arbitrary code
+CUT_NAMES = {"events", "ak", "np"}
+CUT_NODES = (
+    ast.Expression, ast.Compare, ast.BoolOp, ast.BinOp, ast.UnaryOp, ast.Attribute, ast.Name, ast.Call, ast.keyword,
+    ast.Subscript, ast.Slice, ast.Tuple, ast.Constant, ast.Load, ast.boolop, ast.operator, ast.unaryop, ast.cmpop,
+)
+
+def check_cut(expr):
+    try:
+        tree = ast.parse(expr, mode="eval")
+    except SyntaxError as e:
+        raise ValueError(f"Invalid cut {expr!r}: {e.msg}") from e
+    for node in ast.walk(tree):
+        if not isinstance(node, CUT_NODES):
+            raise ValueError(f"Invalid cut {expr!r}: {type(node).__name__} is not allowed")
+        if isinstance(node, ast.Name) and node.id not in CUT_NAMES:
+            raise ValueError(f"Invalid cut {expr!r}: unknown name {node.id} (only {', '.join(sorted(CUT_NAMES))})")
+        if isinstance(node, ast.Attribute) and node.attr.startswith("_"):
+            raise ValueError(f"Invalid cut {expr!r}: private attribute {node.attr}")
+    return expr
+
+# expression text of a command line cut is also its name
+def parse_cuts(exprs):
+    return [(expr, check_cut(expr)) for expr in exprs]
+
+@lru_cache
+def compile_cuts(cuts):
+    return [(name, compile(check_cut(expr), f"<cut {name}>", "eval")) for name,expr in cuts]
+
+# events passing each cut in sequence and time spent per cut, mergeable like the stats accumulators
+class CutflowAccumulator:
+    def __init__(self, N=0):
+        self.N = N
+        self.cuts = {}
+
+    def add(self, name, npass, seconds):
+        self.cuts[name] = (npass, seconds)
+
+    def merge(self, other):
+        self.N += other.N
+        for name,(npass,seconds) in other.cuts.items():
+            prev_pass, prev_seconds = self.cuts.get(name, (0, 0.))
+            self.cuts[name] = (prev_pass+npass, prev_seconds+seconds)
+        return self
+
+    def result(self):
+        return {"all": {"N": self.N, "time": 0.}, **{name: {"N": npass, "time": seconds} for name,(npass,seconds) in self.cuts.items()}}
+
+# cuts are applied in sequence, so a cut can rely on the previous ones (e.g. events.FatJet[:,1] after two_fatjets);
+# events are only sliced when a cut removes some of them
+def select_events(events, cuts):
+    cutflow = CutflowAccumulator(len(events))
+    for name,code in compile_cuts(tuple(cuts)):
+        start = time.perf_counter()
+        mask = ak.to_numpy(ak.fill_none(eval(code, {"__builtins__": {}, "ak": ak, "np": np}, {"events": events}), False))
+        if not mask.all():
+            events = events[mask]
+        cutflow.add(name, len(events), time.perf_counter()-start)
+    return events, cutflow
+
+# derived per-event quantities and stats for one set of events
+def derive_columns(events, helper, with_constituents=True, debug=False, fastjet_batch_size=2000, fastjet_workers=1, groups=None, cuts=()):
+    with PROFILER.stage("selection"):
+        events, cutflow = select_events(events, BASE_CUTS + list(cuts))
+    meta_dict = {"cutflow": cutflow}
+    if len(events)==0:
+        # empty stats (NaN in the output), so that an empty selection still gives a complete summary
+        meta_dict.update({key: StatsAccumulator() for key in ["alpha_3body", "stable_invisible_fraction"]})
+        return None, meta_dict
 
     # Dijet
     events["Dijet"] = events.FatJet[:,0]+events.FatJet[:,1]
@@ -300,22 +664,21 @@ def histogram(filename, helper, with_constituents=True, debug=False):
 
     events["DeltaPhi_MET_Jet12"] = np.abs(events.MissingET.deltaphi(events["Jet12"]))
 
-    # add substructure quantities
-    kt_cuts = [1,2,5,10]
-    n_ecf = [2,3]
-    if with_constituents:
-        events["Jet12_girth"] = calculate_girth(events["Jet12"])
-        events["Jet12_ptD"] = calculate_ptD(events["Jet12"])
-        events["Jet12_majoraxis"], events["Jet12_minoraxis"] = calc_axis1_axis2(events["Jet12"])
+    # add substructure quantities (skipped if those histograms are not requested)
+    if with_constituents and (groups is None or "substructure" in groups):
+        with PROFILER.stage("jet_substructure"):
+            substructure = jet_substructure(events["Jet12"])
+        events["Jet12_girth"] = substructure["girth"]
+        events["Jet12_ptD"] = substructure["ptD"]
+        events["Jet12_majoraxis"] = substructure["axis1"]
+        events["Jet12_minoraxis"] = substructure["axis2"]
 
-        # maybe do this in a nicer way, looping is annoying
         jet12_shape = ak.num(events['Jet12'],axis=1)
         jet12_flat = ak.flatten(events['Jet12'],axis=1)
-        cs = fj_cluster_sequence(jet12_flat)
-        for k in kt_cuts: 
-            events[f"Jet12_lundMult{k}"] = ak.unflatten(getLundMultiplicity(cs, kt = k), jet12_shape)
-        for n in n_ecf:
-            events[f"Jet12_ECF{n}"] = ak.unflatten(getECF(cs, npointECF = n), jet12_shape)
+        with PROFILER.stage("fastjet"):
+            reclustered = recluster(jet12_flat, KT_CUTS, N_ECF, fastjet_batch_size, fastjet_workers)
+        for name,values in reclustered.items():
+            events[f"Jet12_{name}"] = ak.unflatten(values, jet12_shape)
 
     events["Jet12_sdmass"] = events["Jet12"].SoftDroppedJet.mass
     events["Jet12_sdpt"] = events["Jet12"].SoftDroppedJet.pt
@@ -326,7 +689,6 @@ def histogram(filename, helper, with_constituents=True, debug=False):
     pid = events.GenParticle["PID"]
 
     # mediator (gen-level)
-    mmed = helper.mmed
     mediator_id = helper.mediatorID
     is_med = pid==mediator_id
     meds = events.GenParticle[is_med]
@@ -339,8 +701,8 @@ def histogram(filename, helper, with_constituents=True, debug=False):
     events["mMediator"] = meds_final.mass
 
     # Add the invisible fraction to the events
-    print(f"Predicted rinv = {output['model'].get('rinv_3body', output.get('rinvpred_3body', output['model'].get('rinv',output['model'].get('rinvpred', -1)))):.5}")
-    calc_rinv(events, helper, meta_dict, debug)
+    with PROFILER.stage("calc_rinv"):
+        calc_rinv(events, helper, meta_dict, debug)
 
     # dark hadron jets and corresponding visible and invisible+visible jets
     events["DHJet12"] = ak.pad_none(events.DarkHadronJet[:,0:2], target=2, axis=1)
@@ -348,38 +710,24 @@ def histogram(filename, helper, with_constituents=True, debug=False):
     events["DHIVJet12"] = ak.pad_none(events.DarkHadronStableJet[:,0:2], target=2, axis=1)
     dhj_pre = ["DH", "DHV", "DHIV"]
     jet_inds = [0, 1, slice(0, 2)]
-    jet_ind_names = ["1","2","1,2"]
     jet_ind_keys = ["1","2","12"]
 
-    if with_constituents:
+    # dark jet constituent quantities (skipped if those histograms are not requested)
+    if with_constituents and (groups is None or "darkjets" in groups):
         # per-jet calculation of invisible fraction based on momentum projection
         # pick out dark hadron constituents (stability already checked in Delphes)
-        dark_hadron_final_ids = helper.darkHadronFinalIDs
-        is_dark = ak.zeros_like(events["DHIVJet12"].Constituents.PID)
-        for dhid in dark_hadron_final_ids:
-            is_dark = is_dark | (np.abs(events["DHIVJet12"].Constituents.PID)==dhid)
-        is_dark = is_dark==1
+        is_dark = pid_in(events["DHIVJet12"].Constituents.PID, helper.darkHadronFinalIDs)
         events["DHIVJet12", "DHConstituents"] = events["DHIVJet12", "Constituents"][is_dark]
 
         def fill_DHIVJet_rinv(numer, denom, suff):
             events[f"DHIVJet12_rinv_{suff}"] = ak.sum(numer, axis=-1)/ak.sum(denom, axis=-1)
             for ind,key in zip(jet_inds, jet_ind_keys):
                 meta_dict[f"DHIVJet{key}_rinv_{suff}"] = fill_stats(events[f"DHIVJet12_rinv_{suff}"][:, ind])
-            print(f"Average jet-level rinv ({suff}) =", ", ".join(
-                [f"{meta_dict[f'DHIVJet{key}_rinv_{suff}']['mean']:.5} ({meta_dict[f'DHIVJet{key}_rinv_{suff}']['stdev']:.5})" for key in jet_ind_keys]
-            ))
             # summing jets
             events[f"DiDHIVJet_rinv_{suff}"] = ak.sum(ak.flatten(numer, axis=2), axis=-1)/ak.sum(ak.flatten(denom, axis=2), axis=-1)
             meta_dict[f"DiDHIVJet_rinv_{suff}"] = fill_stats(events[f"DiDHIVJet_rinv_{suff}"])
-            print(f"Average dijet-level rinv ({suff}) =",
-                f"{meta_dict[f'DiDHIVJet_rinv_{suff}']['mean']:.5} ({meta_dict[f'DiDHIVJet_rinv_{suff}']['stdev']:.5})"
-            )
             # global version, summing all events
-            rinv_global = ak.sum(ak.flatten(numer, axis=1))/ak.sum(ak.flatten(denom, axis=1))
-            meta_dict[f"DHIVJet12_rinv_{suff}_global"] = {"N": 1, "mean": rinv_global, "stdev": 0, "stderr": 0}
-            print(f"Global jet-level rinv ({suff}) =",
-                f"{meta_dict[f'DHIVJet12_rinv_{suff}_global']['mean']:.5}"
-            )
+            meta_dict[f"DHIVJet12_rinv_{suff}_global"] = fill_global_stats(ak.sum(ak.flatten(numer, axis=None)), ak.sum(ak.flatten(denom, axis=None)))
 
         # project constituent momentum onto jet axis
         proj_numer = proj(events, "DHIVJet12", "DHConstituents")
@@ -394,34 +742,22 @@ def histogram(filename, helper, with_constituents=True, debug=False):
         # dark jet and visible jet radius
         dr_pcts = [90,95,99]
         for pre in dhj_pre:
-            print(f"\n{pre}Jet")
 
             # also compute nconst and girth
-            events[f"{pre}Jet12_girth"] = calculate_girth(events[f"{pre}Jet12"])
-            events[f"{pre}Jet12_nconst"] = ak.num(events[f"{pre}Jet12"].Constituents, axis=-1)
+            flat = flatten_jets(events[f"{pre}Jet12"])
+            substructure = jet_substructure(events[f"{pre}Jet12"], flat)
+            events[f"{pre}Jet12_girth"] = substructure["girth"]
+            events[f"{pre}Jet12_nconst"] = substructure["nconst"]
 
             # pt-weighted percentile per jet
             # scalar sum of constituent pT within DeltaR / scalar sum of all constituent pT = "jet shape"
+            with PROFILER.stage("jet_shape"):
+                shape = jet_shape(events[f"{pre}Jet12"], dr_pcts, flat=flat)
             for pct in dr_pcts:
-                none_mask = ak.is_none(events[f"{pre}Jet12"], axis=1)
-                const_prop = ak.zip({
-                    'dr': deltaR(events[f"{pre}Jet12"]),
-                    'pt': events[f"{pre}Jet12"].Constituents.pt,
-                })[~none_mask]
-                sort_indices = ak.argsort(const_prop.dr, axis=-1)
-                sorted_prop = const_prop[sort_indices]
-                cumul_pt = jet_const_cumsum(sorted_prop.pt)
-                # last element of sum is total from all constituents
-                total_pt = ak.fill_none(ak.pad_none(cumul_pt, 1, axis=-1)[:, :, -1], 0)
-                target_pt = pct/100 * total_pt
-                mask_pt = cumul_pt >= target_pt
-                events[f"{pre}Jet12_radius{pct}"] = ak.pad_none(ak.firsts(sorted_prop[mask_pt].dr, axis=-1), target=2, axis=1)
+                events[f"{pre}Jet12_radius{pct}"] = shape["radius"][pct]
                 for ind,key in zip(jet_inds, jet_ind_keys):
                     r_pct_pt = events[f"{pre}Jet12_radius{pct}"][:, ind]
-                    meta_dict[f"DHJet{key}_radius{pct}"] = fill_stats(r_pct_pt)
-                print(f"{pct}% radius (jet shape):", ", ".join(
-                    [f"{meta_dict[f'DHJet{key}_radius{pct}']['mean']:.2} ({meta_dict[f'DHJet{key}_radius{pct}']['stdev']:.2})" for key in jet_ind_keys]
-                ))
+                    meta_dict[f"{pre}Jet{key}_radius{pct}"] = fill_stats(r_pct_pt)
 
     # dark hadron jet mass and pt
     events["DHJet12_pt"] = events["DHJet12"].pt
@@ -437,114 +773,231 @@ def histogram(filename, helper, with_constituents=True, debug=False):
     events["DiDHIVJet"] = events["DHIVJet12"][:,0] + events["DHIVJet12"][:,1]
     events["DiDHIVJet_mass"] = events["DiDHIVJet"].mass
 
-    # bind events into filling functions
-    def fill_single_hist(var,nbins,bmin,bmax,label,ind=None):
-        h = (
-            hist.Hist.new
-            .Reg(nbins, bmin, bmax, label=label)
-            .Double()
-        )
-        event_var = events[var]
-        if ind is not None:
-            event_var = events[var][:,ind]
-        h.fill(ak.flatten(event_var,axis=None))
-        return h
-
-    def fill_hist(var,nbins,bmin,bmax,label):
-        split = "JETIND" in label
-        if not split:
-            # still return a list of pairs for consistency w/ below usage of chain.from_iterable
-            return [(var,fill_single_hist(var,nbins,bmin,bmax,label))]
+    # keep only the quantities that get histogrammed (in any group, so saved columns can be rebinned for other groups)
+    columns = events[[var for var in hist_vars() if var in events.fields]]
+    return columns, meta_dict
+
+# binning (nbins, min, max) as a function of the mediator mass
+def fixed_bins(nbins, bmin, bmax):
+    return lambda mmed: (nbins, bmin, bmax)
+
+def mmed_bins(nbins, bmin, frac):
+    return lambda mmed: (nbins, bmin, mmed*frac)
+
+# histogram specification:
+# name: key in the output (several specs can share one var, e.g. with different binnings)
+# split: var is a padded Jet12-style column, filled with a jet category axis (JETIND in the label; per-jet views from JetHists)
+# group: histogram family, to fill only a subset (see HIST_GROUPS)
+HistSpec = namedtuple("HistSpec", ["name", "var", "binning", "label", "split", "group"])
+
+def hist_spec(var, binning, label, group, name=None):
+    return HistSpec(name if name is not None else var, var, binning, label, "JETIND" in label, group)
+
+HIST_GROUPS = ["kinematics", "substructure", "darkjets", "gen"]
+KT_CUTS = [1,2,5,10]
+N_ECF = [2,3]
+
+HIST_SPECS = [
+    hist_spec("MT", mmed_bins(50,0,1.5), r"$m_{\text{T}}$ [GeV]", "kinematics"),
+    hist_spec("Dijet_pt", mmed_bins(50,0,0.75), r"$p_{\text{T}}(JJ)$ [GeV]", "kinematics"),
+    hist_spec("Dijet_eta", fixed_bins(50,-10,10), r"$\eta(JJ)$ [GeV]", "kinematics"),
+    hist_spec("Dijet_phi", fixed_bins(25,-3.15,3.15), r"$\phi(JJ)$", "kinematics"),
+    hist_spec("Dijet_mass", mmed_bins(50,0,1.5), r"$m_{JJ}$ [GeV]", "kinematics"),
+    hist_spec("Jet12_pt", mmed_bins(50,0,0.75), r"$p_{\text{T}}(J_{JETIND})$ [GeV]", "kinematics"),
+    hist_spec("Jet12_eta", fixed_bins(50,-6,6), r"$\eta(J_{JETIND})$", "kinematics"),
+    hist_spec("Jet12_phi", fixed_bins(25,-3.15,3.15), r"$\phi(J_{JETIND})$", "kinematics"),
+    hist_spec("Jet12_mass", fixed_bins(50,0,250), r"$m_{J_{JETIND}}$ [GeV]", "kinematics"),
+    hist_spec("MET", mmed_bins(50,0,0.75), r"$p_{\text{T}}^{\text{miss}}$ [GeV]", "kinematics"),
+    hist_spec("DeltaEta", fixed_bins(35,0,8.0), r"$\Delta\eta(JJ)$", "kinematics"),
+    hist_spec("DeltaPhi", fixed_bins(20,0,3.15), r"$\Delta\phi(JJ)$", "kinematics"),
+    hist_spec("DeltaPhi_MET_Jet12", fixed_bins(25,0,3.15), r"$\Delta\phi(J_{JETIND},p_{\text{T}}^{\text{miss}})$", "kinematics"),
+    # constituent-based
+    hist_spec("Jet12_girth", fixed_bins(50,0,1), r"$g_{\text{jet}}(J_{JETIND})$", "substructure"),
+    hist_spec("Jet12_ptD", fixed_bins(50,0,1.01), r"$D_{p_{\text{T}}}(J_{JETIND})$", "substructure"),
+    hist_spec("Jet12_majoraxis", fixed_bins(50,0,0.5), r"$\sigma_{\text{major}}(J_{JETIND})$", "substructure"),
+    hist_spec("Jet12_minoraxis", fixed_bins(50,0,0.5), r"$\sigma_{\text{minor}}(J_{JETIND})$", "substructure"),
+    hist_spec("DHIVJet12_rinv_proj", fixed_bins(25,0,1), r"$r_{\text{inv}}^{\text{kin}}(J_{JETIND}^{\text{stable}})$", "darkjets"),
+    hist_spec("DiDHIVJet_rinv_proj", fixed_bins(25,0,1), r"$r_{\text{inv}}^{\text{kin}}(J^{\text{stable}}J^{\text{stable}})$", "darkjets"),
+    hist_spec("DHIVJet12_rinv_shape", fixed_bins(25,0,1), r"$r_{\text{inv}}^{\text{kin(alt)}}(J_{JETIND}^{\text{stable}})$", "darkjets"),
+    hist_spec("DiDHIVJet_rinv_shape", fixed_bins(25,0,1), r"$r_{\text{inv}}^{\text{kin(alt)}}(J^{\text{stable}}J^{\text{stable}})$", "darkjets"),
+]
+HIST_SPECS.extend(hist_spec(f"Jet12_lundMult{k}", fixed_bins(12,0,12), f'Primary Lund Multiplicity $k_T$>{k} GeV$', "substructure") for k in KT_CUTS)
+HIST_SPECS.extend(hist_spec(f"Jet12_ECF{n}", fixed_bins(30,0,0.3), f'$C_{n}^{{\\beta=1}}$', "substructure") for n in N_ECF)
+for pre,label,nmax,nbin in zip(["DH", "DHV", "DHIV"], ["DH", "vis", "stable"], [24.5, 199.5, 199.5], [25, 50, 50]):
+    HIST_SPECS.extend([
+        hist_spec(f"{pre}Jet12_radius90", fixed_bins(50,0,2), r"${\Delta}R_{90}(J_{JETIND}^{\text{"+label+"}})$", "darkjets"),
+        hist_spec(f"{pre}Jet12_radius95", fixed_bins(50,0,2), r"${\Delta}R_{95}(J_{JETIND}^{\text{"+label+"}})$", "darkjets"),
+        hist_spec(f"{pre}Jet12_radius99", fixed_bins(50,0,2), r"${\Delta}R_{99}(J_{JETIND}^{\text{"+label+"}})$", "darkjets"),
+        hist_spec(f"{pre}Jet12_girth", fixed_bins(50,0,1), r"$g_{\text{jet}}(J_{JETIND}^{\text{"+label+"}})$", "darkjets"),
+        hist_spec(f"{pre}Jet12_nconst", fixed_bins(nbin,-0.5,nmax), r"$n_{\text{const}}(J_{JETIND}^{\text{"+label+"}})$", "darkjets"),
+    ])
+HIST_SPECS.extend([
+    hist_spec("Jet12_sdmass", fixed_bins(50,0,150), r"$m_{\text{SD}}(J_{JETIND})$ [GeV]", "substructure"),
+    hist_spec("Jet12_sdpt", mmed_bins(50,0,0.75), r"$p^{\text{SD}}_{\text{T}}(J_{JETIND})$ [GeV]", "substructure"),
+    hist_spec("stable_invisible_fraction", fixed_bins(25,0,1), r"$r_{\text{inv}}^{\text{gen}}$", "gen"),
+    hist_spec("alpha_3body", fixed_bins(50,0,1), r"$\alpha_{\text{3body}}$", "gen"),
+    hist_spec("mMediator", mmed_bins(50,0,1.5), r"$m_{\text{mediator}}$ [GeV]", "gen"),
+    hist_spec("DHJet12_pt", mmed_bins(50,0,0.75), r"$p_{\text{T}}(J_{JETIND}^{\text{DH}})$ [GeV]", "darkjets"),
+    hist_spec("DHVJet12_pt", mmed_bins(50,0,0.75), r"$p_{\text{T}}(J_{JETIND}^{\text{vis}})$ [GeV]", "darkjets"),
+    hist_spec("DHIVJet12_pt", mmed_bins(50,0,0.75), r"$p_{\text{T}}(J_{JETIND}^{\text{stable}})$ [GeV]", "darkjets"),
+    hist_spec("DiDHJet_mass", mmed_bins(50,0,1.5), r"$m_{J^{\text{DH}}J^{\text{DH}}}$ [GeV]", "darkjets"),
+    hist_spec("DiDHVJet_mass", mmed_bins(50,0,1.5), r"$m_{J^{\text{vis}}J^{\text{vis}}}$ [GeV]", "darkjets"),
+    hist_spec("DiDHVJet_MT", mmed_bins(50,0,1.5), r"$m_{\text{T}}^{J^{\text{vis}}J^{\text{vis}}}$ [GeV]", "darkjets"),
+    hist_spec("DiDHIVJet_mass", mmed_bins(50,0,1.5), r"$m_{J^{\text{stable}}J^{\text{stable}}}$ [GeV]", "darkjets"),
+])
+# N-subjettiness and ratios (see getTau)
+for i in range(1,6):
+    HIST_SPECS.append(hist_spec(f"Jet12_tau{i}", fixed_bins(40,0,1), f"$\\tau_{{{i},J_{{JETIND}}}}$", "substructure"))
+    if i != 1: HIST_SPECS.append(hist_spec(f"Jet12_tau{i}{i-1}", fixed_bins(40,0,1), f"$\\tau_{{{i}{i-1},J_{{JETIND}}}}$", "substructure"))
+
+# columns of all specs, in registry order
+def hist_vars():
+    return list(dict.fromkeys(spec.var for spec in HIST_SPECS))
+
+# specs in the requested groups (default: all)
+def hist_specs(groups=None):
+    return [spec for spec in HIST_SPECS if groups is None or spec.group in groups]
+
+# histograms from derived columns (binning only: no access to the input events)
+# each column is flattened once, and all histograms of that column are filled from the same buffer;
+# specs whose column was not derived (e.g. without constituents) are skipped
+def make_histograms(columns, mmed, groups=None):
+    specs_by_var = defaultdict(list)
+    for spec in hist_specs(groups):
+        if spec.var in columns.fields:
+            specs_by_var[spec.var].append(spec)
+
+    # split specs: one histogram with a jet category axis (see JetHists for the per-jet views)
+    def new_hist(spec):
+        nbins, bmin, bmax = spec.binning(mmed)
+        axes = [hist.axis.Regular(nbins, bmin, bmax, label=spec.label)]
+        if spec.split:
+            axes.append(hist.axis.IntCategory([1, 2], name=JET_AXIS, label="jet", flow=False))
+        return hist.Hist(*axes, storage=hist.storage.Double())
+
+    filled = {}
+    for var,specs in specs_by_var.items():
+        column = columns[var]
+        if specs[0].split:
+            # (events, 2) values, flattened over both jets with the jet number of each entry (padded jets are None)
+            padded = ak.to_numpy(ak.pad_none(column, 2, axis=1, clip=True))
+            valid = ~np.ma.getmaskarray(padded)
+            fill_args = (np.ma.getdata(padded)[valid], np.broadcast_to(np.array([1, 2]), valid.shape)[valid])
         else:
-            results = []
-            for ind,key,name in zip(jet_inds, jet_ind_keys, jet_ind_names):
-                results.append((var.replace("Jet12",f"Jet{key}"), fill_single_hist(var,nbins,bmin,bmax,label.replace("JETIND",name),ind)))
-            return results
-
-    # Creating hist objects
-    hist_dict = dict(chain.from_iterable([
-        fill_hist("MT",50,0,mmed*1.5,r"$m_{\text{T}}$ [GeV]"),
-        fill_hist("Dijet_pt",50,0,mmed*0.75,r"$p_{\text{T}}(JJ)$ [GeV]"),
-        fill_hist("Dijet_eta",50,-10,10,r"$\eta(JJ)$ [GeV]"),
-        fill_hist("Dijet_phi",25,-3.15,3.15,r"$\phi(JJ)$"),
-        fill_hist("Dijet_mass",50,0,mmed*1.5,r"$m_{JJ}$ [GeV]"),
-        fill_hist("Jet12_pt",50,0,mmed*0.75,r"$p_{\text{T}}(J_{JETIND})$ [GeV]"),
-        fill_hist("Jet12_eta",50,-6,6,r"$\eta(J_{JETIND})$"),
-        fill_hist("Jet12_phi",25,-3.15,3.15,r"$\phi(J_{JETIND})$"),
-        fill_hist("Jet12_mass",50,0,250,r"$m_{J_{JETIND}}$ [GeV]"),
-        fill_hist("MET",50,0,mmed*0.75,r"$p_{\text{T}}^{\text{miss}}$ [GeV]"),
-        fill_hist("DeltaEta",35,0,8.0,r"$\Delta\eta(JJ)$"),
-        fill_hist("DeltaPhi",20,0,3.15,r"$\Delta\phi(JJ)$"),
-        fill_hist("DeltaPhi_MET_Jet12",25,0,3.15,r"$\Delta\phi(J_{JETIND},p_{\text{T}}^{\text{miss}})$"),
-    ]))
-    if with_constituents:
-        hist_dict.update(chain.from_iterable([
-            fill_hist("Jet12_girth",50,0,1,r"$g_{\text{jet}}(J_{JETIND})$"),
-            fill_hist("Jet12_ptD",50,0,1.01,r"$D_{p_{\text{T}}}(J_{JETIND})$"),
-            fill_hist("Jet12_majoraxis",50,0,0.5,r"$\sigma_{\text{major}}(J_{JETIND})$"),
-            fill_hist("Jet12_minoraxis",50,0,0.5,r"$\sigma_{\text{minor}}(J_{JETIND})$"),
-            fill_hist("DHIVJet12_rinv_proj",25,0,1,r"$r_{\text{inv}}^{\text{kin}}(J_{JETIND}^{\text{stable}})$"),
-            fill_hist("DiDHIVJet_rinv_proj",25,0,1,r"$r_{\text{inv}}^{\text{kin}}(J^{\text{stable}}J^{\text{stable}})$"),
-            fill_hist("DHIVJet12_rinv_shape",25,0,1,r"$r_{\text{inv}}^{\text{kin(alt)}}(J_{JETIND}^{\text{stable}})$"),
-            fill_hist("DiDHIVJet_rinv_shape",25,0,1,r"$r_{\text{inv}}^{\text{kin(alt)}}(J^{\text{stable}}J^{\text{stable}})$"),
-        ]))
-        for k in kt_cuts: 
-            label = f'Primary Lund Multiplicity $k_T$>{k} GeV$'
-            hist_dict.update(chain.from_iterable([
-                fill_hist(f'Jet12_lundMult{k}',12,0,12,label)
-            ]))    
-        for n in n_ecf:
-            label = f'$C_{n}^{{\\beta=1}}$'
-            hist_dict.update(chain.from_iterable([
-                fill_hist(f'Jet12_ECF{n}',30,0,0.3,label)
-            ]))
-
-        dhj_labels = ["DH", "vis", "stable"]
-        dhj_nmax = [24.5, 199.5, 199.5]
-        dhj_nbin = [25, 50, 50]
-        for pre,label,nmax,nbin in zip(dhj_pre, dhj_labels,dhj_nmax,dhj_nbin):
-            hist_dict.update(chain.from_iterable([
-                fill_hist(f"{pre}Jet12_radius90",50,0,2,r"${\Delta}R_{90}(J_{JETIND}^{\text{"+label+"}})$"),
-                fill_hist(f"{pre}Jet12_radius95",50,0,2,r"${\Delta}R_{95}(J_{JETIND}^{\text{"+label+"}})$"),
-                fill_hist(f"{pre}Jet12_radius99",50,0,2,r"${\Delta}R_{99}(J_{JETIND}^{\text{"+label+"}})$"),
-                fill_hist(f"{pre}Jet12_girth",50,0,1,r"$g_{\text{jet}}(J_{JETIND}^{\text{"+label+"}})$"),
-                fill_hist(f"{pre}Jet12_nconst",nbin,-0.5,nmax,r"$n_{\text{const}}(J_{JETIND}^{\text{"+label+"}})$"),
-            ]))
-    hist_dict.update(chain.from_iterable([
-        fill_hist("Jet12_sdmass",50,0,150,r"$m_{\text{SD}}(J_{JETIND})$ [GeV]"),
-        fill_hist("Jet12_sdpt",50,0,mmed*0.75,r"$p^{\text{SD}}_{\text{T}}(J_{JETIND})$ [GeV]"),
-        fill_hist("stable_invisible_fraction",25,0,1,r"$r_{\text{inv}}^{\text{gen}}$"),
-        fill_hist("alpha_3body",50,0,1,r"$\alpha_{\text{3body}}$"),
-        fill_hist("mMediator",50,0,mmed*1.5,r"$m_{\text{mediator}}$ [GeV]"),
-        fill_hist("DHJet12_pt",50,0,mmed*0.75,r"$p_{\text{T}}(J_{JETIND}^{\text{DH}})$ [GeV]"),
-        fill_hist("DHVJet12_pt",50,0,mmed*0.75,r"$p_{\text{T}}(J_{JETIND}^{\text{vis}})$ [GeV]"),
-        fill_hist("DHIVJet12_pt",50,0,mmed*0.75,r"$p_{\text{T}}(J_{JETIND}^{\text{stable}})$ [GeV]"),
-        fill_hist("DiDHJet_mass",50,0,mmed*1.5,r"$m_{J^{\text{DH}}J^{\text{DH}}}$ [GeV]"),
-        fill_hist("DiDHVJet_mass",50,0,mmed*1.5,r"$m_{J^{\text{vis}}J^{\text{vis}}}$ [GeV]"),
-        fill_hist("DiDHVJet_MT",50,0,mmed*1.5,r"$m_{\text{T}}^{J^{\text{vis}}J^{\text{vis}}}$ [GeV]"),
-        fill_hist("DiDHIVJet_mass",50,0,mmed*1.5,r"$m_{J^{\text{stable}}J^{\text{stable}}}$ [GeV]"),
-    ]))
-
-    for t in events.fields:
-        if 'tau' not in t: continue
-        l = t.split('_')
-        label = l[1].replace('tau', '$\\tau_{')+','+l[0].replace('et12', '_{JETIND}')+'}$'
-        hist_dict.update(chain.from_iterable([
-            fill_hist(t,40,0,1,label)
-        ]))
+            fill_args = (ak.to_numpy(ak.flatten(column, axis=None)),)
+        for spec in specs:
+            filled[spec.name] = new_hist(spec).fill(*fill_args)
+
+    # registry order
+    return {spec.name: filled[spec.name] for spec in hist_specs(groups) if spec.name in filled}
+
+# histograms, stats, and bytes read for one entry range (module-level so that it can run in a worker process)
+# columns_dir: also write the derived columns of this range there (Parquet)
+# profile: also return the time and memory per stage (see common.Profiler)
+def histogram_chunk(filename, helper, with_constituents, debug, entry_start, entry_stop, columns_dir=None, fastjet_batch_size=2000, fastjet_workers=1, groups=None, cuts=(), profile=False, schema=DelphesSchema2):
+    if profile:
+        PROFILER.enable()
+    access_log = []
+    with PROFILER.collect() as profile_chunk:
+        # columns are read lazily: reading time is counted in the stage that first uses them
+        with PROFILER.stage("load_events"):
+            events = load_events(filename, schema=schema, with_constituents=with_constituents, columns=HIST_COLUMNS, access_log=access_log, entry_start=entry_start, entry_stop=entry_stop)
+        with PROFILER.stage("derive_columns"):
+            columns, meta_dict = derive_columns(events, helper, with_constituents, debug, fastjet_batch_size, fastjet_workers, groups, cuts)
+        hist_dict = {}
+        if columns is not None:
+            with PROFILER.stage("make_histograms"):
+                hist_dict = make_histograms(columns, helper.mmed, groups)
+            if columns_dir is not None:
+                ak.to_parquet(columns, f"{columns_dir}/part{entry_start}-{entry_stop}.parquet")
+    return hist_dict, meta_dict, io_report(filename, access_log, entry_start, entry_stop), profile_chunk
+
+# derived column files in entry order
+def columns_parts(columns_dir):
+    return sorted(glob(f"{columns_dir}/part*.parquet"), key=lambda part: int(os.path.basename(part)[4:].split("-")[0]))
+
+# fast path: redo the binning from saved derived columns, without reading or processing the events
+# groups: histogram groups to fill (default: all)
+def rebuild_histograms(columns_dir, outname="Hists.pkl", groups=None):
+    with open(f"{columns_dir}/output.pkl", "rb") as infile:
+        saved = pickle.load(infile)
+    output = saved["output"]
+    hist_dict = {}
+    for part in columns_parts(columns_dir):
+        merge_hists(hist_dict, make_histograms(ak.from_parquet(part), saved["mmed"], groups))
+    output["hist"] = hist_dict
+    with open(outname, "wb") as out:
+        pickle.dump(output, out)
+
+# chunk_size: process the file in entry ranges of this size, so memory does not scale with the file size
+# workers: process entry ranges in this many local processes (default chunk size: one range per worker)
+# columns_dir: save the derived columns there, so that rebuild_histograms() can rebin them later
+# fastjet_batch_size, fastjet_workers: recluster jets in batches of this many jets, spread over this many processes (per entry range)
+# groups: histogram groups to fill (default: all, see HIST_GROUPS)
+# cuts: (name, expression) pairs applied after BASE_CUTS (see parse_cuts)
+# profile: record time and memory per stage, stored in the "profile" entry of the output (summed over workers)
+# outname: output file for the histograms and stats
+# schema: NanoEvents schema of the input file (e.g. for the synthetic events of BenchmarkAnalysis.py)
+def histogram(filename, helper, with_constituents=True, debug=False, chunk_size=None, workers=1, columns_dir=None, fastjet_batch_size=2000, fastjet_workers=1, groups=None, cuts=(), profile=False, outname="Hists.pkl", schema=DelphesSchema2):
+    if profile:
+        PROFILER.enable()
+    import uproot
+    with uproot.open({filename : "Delphes"}) as tree:
+        num_entries = tree.num_entries
+    if chunk_size is None:
+        chunk_size = max(-(-num_entries//workers), 1)
+    # an empty file is still processed once, so the output has a cutflow
+    entry_ranges = [(entry_start, min(entry_start+chunk_size, num_entries)) for entry_start in range(0, num_entries, chunk_size)] or [(0, 0)]
+
+    # output dictionary with histograms and metadata
+    output = {}
+    output["model"] = helper.metadata()
+    hist_dict = {}
+    meta_dict = {}
+    io_dict = {}
+    if columns_dir is not None:
+        # remove columns from a previous run
+        shutil.rmtree(columns_dir, ignore_errors=True)
+        os.makedirs(columns_dir)
+
+    def merge_chunk(entry_start, entry_stop, result):
+        hist_dict_chunk, meta_dict_chunk, io_dict_chunk, profile_chunk = result
+        if len(entry_ranges)>1:
+            print(f"Processed entries {entry_start}-{entry_stop} of {num_entries}")
+        merge_hists(hist_dict, hist_dict_chunk)
+        merge_meta(meta_dict, meta_dict_chunk)
+        # bytes read per branch
+        merge_io(io_dict, io_dict_chunk)
+        PROFILER.merge(profile_chunk)
+
+    if workers>1 and len(entry_ranges)>1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=min(workers, len(entry_ranges))) as executor:
+            futures = [executor.submit(histogram_chunk, filename, helper, with_constituents, debug, entry_start, entry_stop, columns_dir, fastjet_batch_size, fastjet_workers, groups, cuts, profile, schema) for entry_start,entry_stop in entry_ranges]
+            # merge in entry order, so the output does not depend on which worker finishes first
+            for (entry_start,entry_stop),future in zip(entry_ranges, futures):
+                merge_chunk(entry_start, entry_stop, future.result())
+    else:
+        for entry_start,entry_stop in entry_ranges:
+            merge_chunk(entry_start, entry_stop, histogram_chunk(filename, helper, with_constituents, debug, entry_start, entry_stop, columns_dir, fastjet_batch_size, fastjet_workers, groups, cuts, profile, schema))
 
     # finish output dictionary
     output["hist"] = hist_dict
-    output["analysis"] = meta_dict
+    output["analysis"] = {key: stats.result() for key,stats in meta_dict.items()}
+    output["io"] = dict(sorted(io_dict.items(), key=lambda item: item[1]["compressed"], reverse=True))
+    if PROFILER.enabled:
+        # includes earlier stages of the same process (e.g. run_model steps)
+        output["profile"] = PROFILER.result()
+    print_summary(output, with_constituents)
+    print_io_report(output["io"])
 
-    # alternative 3body rinv calculation using alpha measured from Pythia
-    if helper.mrho < 2*helper.mpi:
-        from svjHelper import fcdc_rinv_3body, fcdc_rinv_3body_simp
-        if helper.Ns is not None:
-            output["model"]['rinv_3body_gen'] = fcdc_rinv_3body(Nf=helper.Nf, Ns=helper.Ns, mrho=helper.mrho, mpi=helper.mpi, pvector=helper.pvector, alpha=meta_dict['alpha_3body']['mean'])
-        else:
-            output["model"]['rinv_3body_gen'] = fcdc_rinv_3body_simp(rinv=helper.rinv, Nf=helper.Nf, mrho=helper.mrho, mpi=helper.mpi, pvector=helper.pvector, alpha=meta_dict['alpha_3body']['mean'])
+    add_rinv_3body_gen(output, helper)
+
+    # everything except the histograms, to be combined with rebinned histograms by rebuild_histograms()
+    if columns_dir is not None:
+        with open(f"{columns_dir}/output.pkl", "wb") as out:
+            pickle.dump({"output": {**output, "hist": None}, "mmed": helper.mmed}, out)
 
     # Saving the histograms
-    with open("Hists.pkl", "wb") as out:
-        pickle.dump(output, out)
\ No newline at end of file
+    save_output(output, outname)
+    return output
\ No newline at end of file
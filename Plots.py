@@ -6,6 +6,7 @@ import matplotlib.pyplot as plt
 import mplhep as hep
 import pickle
 from magiconfig import ArgumentParser, ArgumentDefaultsRawHelpFormatter
+from common import JetHists
 
 samples = [
     {"name": r"FCDC", "model": "fcdc/s-channel_mmed-1000_Nc-3_Nf-3_scale-10_mq-10.119_mpi-6_mrho-25.0998_pvector-0.5_spectrum-fcdc_gq-0.25_gchi-0.333333_Ns-1"},
@@ -64,7 +65,7 @@ for sample in samples:
     with open(file, "rb") as inp:
         hists_model=pickle.load(inp)                # Dict Contains all the histos for 1 model
 
-    hists[sample["name"]] = hists_model['hist']
+    hists[sample["name"]] = JetHists(hists_model['hist'])
 
 # helper to make a plot
 def make_plot(hname,outdir,liny=False):
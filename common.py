@@ -1,5 +1,12 @@
 import os
-from coffea.nanoevents import DelphesSchema
+import copy
+import time
+import resource
+import tracemalloc
+import json
+import fcntl
+from coffea.nanoevents import DelphesSchema, transforms
+from coffea.nanoevents.util import concat
 import numpy as np
 import numba as nb
 from numpy.typing import NDArray
@@ -9,7 +16,15 @@ from coffea.nanoevents.methods.delphes import behavior, _set_repr_name, Particle
 import matplotlib as mpl
 import fnmatch
 import shutil
+import gzip
+import zlib
+import struct
+import subprocess
 from glob import glob
+from collections import defaultdict
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from XRootD import client as xrootd_client
 
 DelphesSchema.mixins.update({
@@ -27,17 +42,34 @@ DelphesSchema.mixins.update({
 
 # workaround for https://cp3.irmp.ucl.ac.be/projects/delphes/ticket/1170
 # manually fix mass units
+GenParticleCollections = [
+    "GenParticle",
+    "GenCandidate",
+    "GenStableCandidate",
+    "DarkHadronCandidate",
+]
+
+# eager version, for schemas other than DelphesSchema2
 def fix_delphes_mass_units(events):
-    GenParticleCollections = [
-        "GenParticle",
-        "GenCandidate",
-        "GenStableCandidate",
-        "DarkHadronCandidate",
-    ]
     for col in GenParticleCollections:
+        # skip collections pruned by load_events
+        if col not in events.fields:
+            continue
         events[col, "Mass"] = events[col]["Mass"]*0.001
     return events
 
+# lazy version: the MeV->GeV scaling is a step in the form key, applied only when the column is read
+def mev_to_gev_form(mass):
+    form = copy.deepcopy(mass)
+    form["form_key"] = concat(mass["form_key"], "!mev_to_gev")
+    return form
+
+def mev_to_gev(stack):
+    stack.append(ak.to_numpy(stack.pop())*0.001)
+
+# coffea looks up form key steps by name in its transforms module
+transforms.mev_to_gev = mev_to_gev
+
 class DelphesSchema2(DelphesSchema):
     jet_const_pairs = {
         "FatJet" : "ParticleFlowCandidate",
@@ -55,96 +87,328 @@ class DelphesSchema2(DelphesSchema):
         base_form["fields"], base_form["contents"] = zip(*[entry for entry in zip(base_form["fields"], base_form["contents"]) if not "fBits" in entry[0]])
         super().__init__(base_form)
 
+    # same as fix_delphes_mass_units (only the Mass field, not the mass alias used by vector methods)
+    def _build_collections(self, branch_forms):
+        output = super()._build_collections(branch_forms)
+        for col in GenParticleCollections:
+            if col not in output:
+                continue
+            record = output[col]["content"]
+            index = record["fields"].index("Mass")
+            record["contents"][index] = mev_to_gev_form(record["contents"][index])
+        return output
+
+# per-stage wall time and peak memory, enabled with run_model --profile (otherwise stages cost nothing)
+# stages can nest (outer stages include inner ones) and repeat (time and calls are summed, memory is the maximum);
+# peak_traced_mb: peak of Python and numpy allocations during the stage (tracemalloc)
+# max_rss_mb: peak resident memory of this process (or of the largest child process, for external programs) so far
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.stages = {}
+        # running maxima of the open stages (tracemalloc has a single peak, reset by each nested stage)
+        self.open_peaks = []
+
+    def enable(self):
+        self.enabled = True
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name, children=False):
+        if not self.enabled:
+            yield
+            return
+        if self.open_peaks:
+            self.open_peaks[-1] = max(self.open_peaks[-1], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        self.open_peaks.append(0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter()-start
+            peak = max(self.open_peaks.pop(), tracemalloc.get_traced_memory()[1])
+            if self.open_peaks:
+                self.open_peaks[-1] = max(self.open_peaks[-1], peak)
+            # kB on Linux
+            rss = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss/1024
+            self.add(name, {"calls": 1, "time": elapsed, "peak_traced_mb": peak/1024**2, "max_rss_mb": rss})
+
+    def add(self, name, stats):
+        if name not in self.stages:
+            self.stages[name] = dict(stats)
+            return
+        prev = self.stages[name]
+        for key in ["calls", "time"]:
+            prev[key] += stats[key]
+        for key in ["peak_traced_mb", "max_rss_mb"]:
+            prev[key] = max(prev[key], stats[key])
+
+    # stages from another process (e.g. a histogramming worker)
+    def merge(self, stages):
+        for name,stats in stages.items():
+            self.add(name, stats)
+
+    # record the stages of a block separately (e.g. one entry range, to be returned from a worker process)
+    @contextmanager
+    def collect(self):
+        saved = self.stages
+        self.stages = {}
+        collected = {}
+        try:
+            yield collected
+        finally:
+            collected.update(self.stages)
+            self.stages = saved
+
+    def result(self):
+        return {name: dict(stats) for name,stats in self.stages.items()}
+
+# shared by all modules of one process
+PROFILER = Profiler()
+
 # ignore unnecessary warning
 from numba.core.errors import NumbaTypeSafetyWarning
 import warnings
 warnings.simplefilter('ignore',category=NumbaTypeSafetyWarning)
-# optimized kernel for jet:constituent matching within an event
-@nb.njit("i8[:](i4[:],u4[:])")
-def get_constituents_kernel(jet_refs: NDArray[np.int32], cand_ids: NDArray[np.uint32]) -> NDArray[np.int64]:
-    # get hash table mapping global index : global unique ID
-    hash_table = {k:v for v,k in enumerate(cand_ids)}
-    # apply hash map
-    output = [hash_table[ref] for ref in jet_refs]
-    return np.asarray(output)
-
-# apply kernel to events (in chunks)
-def get_constituents_chunk(events, jetsname, candsname):
-    jets = events[jetsname]
-    cands = events[candsname]
-
-    flat_indices = []
-    counts_all = []
-    jets_per_event = []
-
-    # compute candidate offsets
-    cand_counts = ak.num(cands, axis=1)
-    cand_offsets = np.cumsum(np.concatenate([[0], ak.to_numpy(cand_counts[:-1])]))
-
-    for i, (jets_evt, cands_evt) in enumerate(zip(jets, cands)):
-        if jets_evt is None:
-            jets_per_event.append(0)
-            continue
-
-        refs = ak.flatten(jets_evt.Constituents.refs)
-        counts = ak.num(jets_evt.Constituents.refs, axis=1)
-
-        jets_per_event.append(len(counts))
-        counts_all.extend(counts.tolist())
-
-        if len(refs) == 0:
-            flat_indices.append(np.array([], dtype=np.int64))
-            continue
-
-        # local indices within event
-        local_idx = get_constituents_kernel(
-            ak.to_numpy(refs),
-            ak.to_numpy(cands_evt.fUniqueID),
+# per-event sorted fUniqueIDs (and the permutation that sorts them) for one candidate collection
+@nb.njit("Tuple((u4[:],i8[:]))(u4[:],i8[:])", nogil=True)
+def get_candidate_index_kernel(cand_ids: NDArray[np.uint32], cand_offsets: NDArray[np.int64]) -> tuple[NDArray[np.uint32], NDArray[np.int64]]:
+    sorted_ids = np.empty_like(cand_ids)
+    perm = np.empty(len(cand_ids), dtype=np.int64)
+    for evt in range(len(cand_offsets)-1):
+        start, stop = cand_offsets[evt], cand_offsets[evt+1]
+        order = np.argsort(cand_ids[start:stop], kind="mergesort")
+        for k in range(stop-start):
+            perm[start+k] = start+order[k]
+            sorted_ids[start+k] = cand_ids[start+order[k]]
+    return sorted_ids, perm
+
+# optimized kernel for jet:constituent matching over a whole chunk of events
+# refs is a flat buffer, ref_offsets and cand_offsets delimit each event
+@nb.njit("i8[:](i4[:],i8[:],u4[:],i8[:],i8[:])", nogil=True)
+def get_constituents_kernel(refs: NDArray[np.int32], ref_offsets: NDArray[np.int64], sorted_ids: NDArray[np.uint32], perm: NDArray[np.int64], cand_offsets: NDArray[np.int64]) -> NDArray[np.int64]:
+    output = np.empty(len(refs), dtype=np.int64)
+    for evt in range(len(ref_offsets)-1):
+        start, stop = cand_offsets[evt], cand_offsets[evt+1]
+        ids_evt = sorted_ids[start:stop]
+        # binary search of global unique ID -> global index
+        for j in range(ref_offsets[evt],ref_offsets[evt+1]):
+            ref = np.uint32(refs[j])
+            k = np.searchsorted(ids_evt, ref)
+            if k==stop-start or ids_evt[k]!=ref:
+                raise KeyError("constituent reference not found in candidates")
+            output[j] = perm[start+k]
+    return output
+
+def counts_to_offsets(counts):
+    offsets = np.zeros(len(counts)+1, dtype=np.int64)
+    offsets[1:] = np.cumsum(counts)
+    return offsets
+
+# lookup table for one candidate collection, shared by all jet collections that point into it
+class CandidateIndex:
+    def __init__(self, cands):
+        cand_counts = ak.to_numpy(ak.fill_none(ak.num(cands, axis=1), 0))
+        self.offsets = counts_to_offsets(cand_counts)
+        self.sorted_ids, self.perm = get_candidate_index_kernel(
+            ak.to_numpy(ak.flatten(cands.fUniqueID, axis=None)).astype(np.uint32, copy=False),
+            self.offsets,
         )
 
-        # convert to global indices
-        global_idx = local_idx + cand_offsets[i]
-
-        flat_indices.append(global_idx)
-
-    # concatenate indices only (cheap)
-    flat_indices = np.concatenate(flat_indices) if flat_indices else np.array([], dtype=np.int64)
-
-    # zero-copy flatten of candidates
-    flat_cands = ak.flatten(cands)
-
-    # single gather
-    gathered = flat_cands[flat_indices]
-
-    # rebuild structure (one level at a time)
-    jets_level = ak.unflatten(gathered, counts_all)
-    events_level = ak.unflatten(jets_level, jets_per_event)
-
-    return ak.with_name(events_level, DelphesSchema2.mixins[candsname])
-
-def get_constituents(events, jetsname, candsname, chunk_size=500):
-    outputs = []
-
-	# chunking avoids memory overusage
-    for start in range(0, len(events), chunk_size):
-        stop = start + chunk_size
-        chunk = events[start:stop]
-
-        outputs.append(
-            get_constituents_chunk(chunk, jetsname, candsname)
+    # returns global indices w.r.t. flattened candidates, constituents per jet, jets per event
+    def resolve(self, jets):
+        # nested refs: events x jets x constituents
+        refs = jets.Constituents.refs
+        jets_per_event = ak.to_numpy(ak.fill_none(ak.num(refs, axis=1), 0))
+        counts_all = ak.to_numpy(ak.flatten(ak.num(refs, axis=2), axis=None))
+        ref_counts = ak.to_numpy(ak.fill_none(ak.sum(ak.num(refs, axis=2), axis=1), 0))
+
+        flat_indices = get_constituents_kernel(
+            ak.to_numpy(ak.flatten(refs, axis=None)).astype(np.int32, copy=False),
+            counts_to_offsets(ref_counts),
+            self.sorted_ids,
+            self.perm,
+            self.offsets,
         )
-
-    return ak.with_name(
-        ak.concatenate(outputs),
-        DelphesSchema2.mixins[candsname]
+        return flat_indices, counts_all, jets_per_event
+
+# resolved arrays: global indices w.r.t. all flattened candidates, constituents per jet, jets per event
+CONSTITUENTS_ARRAYS = ["indices", "counts", "njets"]
+
+# returns {jet: resolved arrays} for the requested jet collections (default: all)
+# indices: optional dict of existing CandidateIndex objects, updated in place
+def resolve_constituents(events, jets=None, indices=None, workers=None):
+    if jets is None:
+        jets = DelphesSchema2.jet_const_pairs
+    pairs = {jet:DelphesSchema2.jet_const_pairs[jet] for jet in jets}
+    if indices is None:
+        indices = {}
+    missing = sorted(set(pairs.values())-set(indices))
+
+    # index/matching kernels release the GIL, so threads can run them concurrently
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # one index per candidate collection, reused by every jet collection that points into it
+        indices.update(zip(missing, executor.map(lambda const: CandidateIndex(events[const]), missing)))
+        results = executor.map(lambda jet: indices[pairs[jet]].resolve(events[jet]), pairs)
+        return dict(zip(pairs, results))
+
+# resolves jet collections on demand (once each), backed by the sidecar cache if a filename is given
+# entry_start: first entry of events in the file (cache entries are specific to each entry range)
+class ConstituentsResolver:
+    def __init__(self, events, filename=None, workers=None, entry_start=0):
+        # keep a view with the original references, unaffected by later field assignments
+        self.events = ak.Array(events)
+        self.filename = filename
+        self.workers = workers
+        self.entries = f"{entry_start}-{entry_start+len(events)}"
+        self.indices = {}
+        self.resolved = {}
+
+    def resolve(self, jets):
+        missing = [jet for jet in jets if jet not in self.resolved]
+        if missing and self.filename is not None:
+            cached = load_constituents_cache(self.filename, [f"{jet}.{self.entries}" for jet in missing])
+            self.resolved.update({jet:cached[f"{jet}.{self.entries}"] for jet in missing if f"{jet}.{self.entries}" in cached})
+            missing = [jet for jet in missing if jet not in self.resolved]
+        if missing:
+            with PROFILER.stage("resolve_constituents"):
+                resolved = resolve_constituents(self.events, missing, self.indices, self.workers)
+            self.resolved.update(resolved)
+            if self.filename is not None:
+                try:
+                    save_constituents_cache(self.filename, {f"{jet}.{self.entries}":arrays for jet,arrays in resolved.items()})
+                except OSError as e:
+                    warnings.warn(f"Could not write constituents cache for {self.filename}: {e}")
+        return {jet:self.resolved[jet] for jet in jets}
+
+    def __call__(self, jet):
+        return self.resolve([jet])[jet]
+
+# Constituents as a virtual array: indices are only resolved when the field is first read,
+# and candidate fields are only read when accessed (no gather copy)
+def lazy_constituents(events, jetsname, candsname, resolver):
+    jets_per_event = ak.to_numpy(ak.fill_none(ak.num(events[jetsname], axis=1), 0))
+    jet_offsets = counts_to_offsets(jets_per_event)
+    form = ak.forms.ListOffsetForm("i64", ak.forms.NumpyForm("int64", form_key="indices"), form_key="counts")
+    resolved = ak.from_buffers(form, jet_offsets[-1], {
+        "counts-offsets": lambda: counts_to_offsets(resolver(jetsname)[1]),
+        "indices-data": lambda: np.asarray(resolver(jetsname)[0], dtype=np.int64),
+    }).layout
+    # naming the candidates directly, since ak.with_name on the result would materialize it
+    flat_cands = ak.with_name(ak.flatten(events[candsname]), DelphesSchema2.mixins[candsname])
+    layout = ak.contents.ListOffsetArray(
+        ak.index.Index64(jet_offsets),
+        ak.contents.ListOffsetArray(
+            resolved.offsets,
+            ak.contents.IndexedArray(ak.index.Index64(resolved.content.data), flat_cands.layout),
+        ),
     )
+    return ak.Array(layout)
 
-def init_constituents(events):
+def init_constituents(events, resolver=None):
+    if resolver is None:
+        resolver = ConstituentsResolver(events)
     for jet,const in DelphesSchema2.jet_const_pairs.items():
+        if jet not in events.fields:
+            continue
+        # already virtual: just a new name for the original references
         events[jet,"ConstituentsOrig"] = events[jet,"Constituents"]
-        events[jet,"Constituents"] = get_constituents(events,jet,const)
+        events[jet,"Constituents"] = lazy_constituents(events, jet, const, resolver)
     return events
 
+# sidecar cache of resolved constituent indices, stored next to the input ROOT file
+def constituents_cache_dir(filename):
+    return os.path.splitext(filename)[0]+"_constituents"
+
+# cache is invalidated if the input file changes
+def constituents_cache_key(filename):
+    stat = os.stat(filename)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+def read_constituents_cache_key(cache_dir):
+    try:
+        with open(f"{cache_dir}/key.json") as keyfile:
+            return json.load(keyfile)
+    except (OSError, ValueError):
+        return None
+
+# cache entry name -> (jet collection, entry_start, entry_stop)
+def parse_cache_entry(entry):
+    jet, entries = entry.rsplit(".", 1)
+    start, stop = entries.split("-")
+    return jet, int(start), int(stop)
+
+# entries of the same jet collection that overlap a new entry with different bounds (from another chunk size)
+def stale_cache_entries(entries, new_entry):
+    jet, start, stop = parse_cache_entry(new_entry)
+    stale = []
+    for entry in entries:
+        old_jet, old_start, old_stop = parse_cache_entry(entry)
+        if old_jet==jet and old_start<stop and start<old_stop and (old_start,old_stop)!=(start,stop):
+            stale.append(entry)
+    return stale
+
+# entries (named "{jet}.{entry_start}-{entry_stop}") are added incrementally;
+# entries from a different chunking that overlap new ones are removed, so the cache holds at most one copy of each event
+# each file is written to a temporary name and moved, so readers never see a partial cache
+def save_constituents_cache(filename, resolved):
+    cache_dir = constituents_cache_dir(filename)
+    file_key = constituents_cache_key(filename)
+    os.makedirs(cache_dir, exist_ok=True)
+    # lock the directory: several processes may fill different entry ranges of the same file
+    dir_fd = os.open(cache_dir, os.O_RDONLY)
+    try:
+        fcntl.flock(dir_fd, fcntl.LOCK_EX)
+        key = read_constituents_cache_key(cache_dir)
+        if key is None or key["file"]!=file_key:
+            for oldfile in glob(f"{cache_dir}/*"):
+                os.remove(oldfile)
+            key = {"file": file_key}
+        entries = set(key.get("entries", []))
+        removed = []
+        for entry,arrays in resolved.items():
+            for stale in stale_cache_entries(entries, entry):
+                entries.discard(stale)
+                removed.append(stale)
+            for name,array in zip(CONSTITUENTS_ARRAYS, arrays):
+                npyname = f"{cache_dir}/{entry}.{name}.npy"
+                with open(npyname+".tmp", "wb") as npyfile:
+                    np.save(npyfile, np.asarray(array, dtype=np.int64))
+                os.replace(npyname+".tmp", npyname)
+        key["entries"] = sorted(entries | set(resolved))
+        with open(f"{cache_dir}/key.json.tmp", "w") as keyfile:
+            json.dump(key, keyfile)
+        os.replace(f"{cache_dir}/key.json.tmp", f"{cache_dir}/key.json")
+        # only after the key no longer lists them
+        for stale in removed:
+            for name in CONSTITUENTS_ARRAYS:
+                try:
+                    os.remove(f"{cache_dir}/{stale}.{name}.npy")
+                except FileNotFoundError:
+                    pass
+    finally:
+        os.close(dir_fd)
+
+# returns the requested entries that are present in a valid cache
+def load_constituents_cache(filename, entries):
+    cache_dir = constituents_cache_dir(filename)
+    key = read_constituents_cache_key(cache_dir)
+    if key is None or key["file"]!=constituents_cache_key(filename):
+        return {}
+    # memory-mapped: only pages that are used get read
+    cached = {}
+    for entry in entries:
+        if entry not in key.get("entries", []):
+            continue
+        try:
+            cached[entry] = tuple(np.load(f"{cache_dir}/{entry}.{name}.npy", mmap_mode="r") for name in CONSTITUENTS_ARRAYS)
+        except FileNotFoundError:
+            # removed by a concurrent run with another chunk size
+            continue
+    return cached
+
 # helper to test that all jet constituents were found
 def sum_4vec(vec):
     summed_vec = {
@@ -160,7 +424,7 @@ def test_constituents(events):
         check_jets = sum_4vec(events[jet,"Constituents"])
         print(jet, check_jets.mass-events[jet].mass)
 
-def load_sample(sample,helper=None,schema=DelphesSchema,with_constituents=False):
+def load_sample(sample,helper=None,schema=DelphesSchema,with_constituents=False,columns=None):
     from coffea.nanoevents import NanoEventsFactory
     path = f'models/{sample["model"]}'
     if helper is None:
@@ -170,26 +434,288 @@ def load_sample(sample,helper=None,schema=DelphesSchema,with_constituents=False)
         sample["helper"] = helper
     metadict = sample["helper"].metadata()
     metadict["dataset"] = sample["name"]
-    sample["events"] = load_events(f'{path}/events.root',schema=schema,metadict=metadict,with_constituents=with_constituents)
-
-def load_events(filename,schema=DelphesSchema,metadict=None,with_constituents=False):
+    sample["events"] = load_events(f'{path}/events.root',schema=schema,metadict=metadict,with_constituents=with_constituents,columns=columns)
+
+# fields required by the schema to build each type of collection
+SCHEMA_FIELDS = {
+    "Jet": ["PT", "Eta", "Phi", "Mass"],
+    "Particle": ["PT", "Eta", "Phi", "Mass"],
+    "Track": ["PT", "Eta", "Phi", "Mass"],
+    "MissingET": ["MET", "Eta", "Phi"],
+    "Photon": ["PT", "ET", "Eta", "Phi"],
+    "Electron": ["PT", "ET", "Eta", "Phi"],
+    "Muon": ["PT", "ET", "Eta", "Phi"],
+    "Tower": ["PT", "ET", "Eta", "Phi"],
+}
+
+# uproot filter on branch names, keeping only the requested collections and fields
+# columns: {collection: list of fields (schema fields added automatically), or None for all fields}
+def make_branch_filter(columns, schema):
+    def branch_filter(name):
+        collection, _, field = name.split("/")[-1].partition(".")
+        if collection.endswith("_size"):
+            return collection[:-len("_size")] in columns
+        if collection not in columns:
+            return False
+        fields = columns[collection]
+        if fields is None or not field:
+            return True
+        # branches named like Tau[5] become Tau_5 in the schema
+        field = field.split(".")[0].replace("[","_").replace("]","")
+        return field in fields or field in SCHEMA_FIELDS.get(schema.mixins.get(collection), [])
+    return branch_filter
+
+def load_events(filename,schema=DelphesSchema,metadict=None,with_constituents=False,cache_constituents=True,columns=None,access_log=None,entry_start=None,entry_stop=None,fast_copy=True):
     from coffea.nanoevents import NanoEventsFactory
-    if with_constituents and schema==DelphesSchema:
+    if schema==DelphesSchema:
         schema = DelphesSchema2
 
+    # only read (and decompress) the declared branches
+    iteritems_options = {}
+    if columns is not None:
+        if not isinstance(columns, dict):
+            columns = {col:None for col in columns}
+        columns = {col:(None if fields is None else list(fields)) for col,fields in columns.items()}
+        if with_constituents:
+            for jet,const in DelphesSchema2.jet_const_pairs.items():
+                if jet not in columns:
+                    continue
+                if columns[jet] is not None:
+                    columns[jet].append("Constituents")
+                columns.setdefault(const, [])
+                if columns[const] is not None:
+                    columns[const].append("fUniqueID")
+        iteritems_options["filter_name"] = make_branch_filter(columns, schema)
+
+    # the constituents cache is still keyed by the original file
+    source = prefer_fast_copy(filename, columns) if fast_copy else filename
+
     events = NanoEventsFactory.from_root(
-        file={filename : "Delphes"},
+        file={source : "Delphes"},
         schemaclass=schema,
         metadata=metadict,
+        iteritems_options=iteritems_options,
+        access_log=access_log,
+        entry_start=entry_start,
+        entry_stop=entry_stop,
     ).events()
 
-    events = fix_delphes_mass_units(events)
+    # DelphesSchema2 already fixes the units (lazily)
+    if not issubclass(schema, DelphesSchema2):
+        events = fix_delphes_mass_units(events)
 
     if with_constituents:
-        events = init_constituents(events)
+        resolver = ConstituentsResolver(events, filename if cache_constituents else None, entry_start=entry_start or 0)
+        events = init_constituents(events, resolver)
 
     return events
 
+# compressed and uncompressed bytes of each branch read by events loaded with access_log=[...]
+def io_report(filename, access_log, entry_start=None, entry_stop=None, fast_copy=True):
+    import uproot
+    # the same file that load_events read
+    if fast_copy:
+        filename = prefer_fast_copy(filename, {branch_collection(accessed.branch) for accessed in access_log})
+    with uproot.open({filename : "Delphes"}) as tree:
+        if entry_start is None:
+            entry_start = 0
+        if entry_stop is None:
+            entry_stop = tree.num_entries
+        report = {}
+        # unique, in order of access
+        for branch_name in dict.fromkeys(accessed.branch for accessed in access_log):
+            branch = tree[branch_name]
+            compressed = 0
+            uncompressed = 0
+            for basket in range(branch.num_baskets):
+                start, stop = branch.basket_entry_start_stop(basket)
+                if start<entry_stop and stop>entry_start:
+                    compressed += branch.basket_compressed_bytes(basket)
+                    uncompressed += branch.basket_uncompressed_bytes(basket)
+            report[branch_name] = {"compressed": compressed, "uncompressed": uncompressed}
+    return dict(sorted(report.items(), key=lambda item: item[1]["compressed"], reverse=True))
+
+# e.g. FatJet for FatJet/FatJet.PT, FatJet.PT, or FatJet_size
+def branch_collection(branch_name):
+    return branch_name.split("/")[0].split(".")[0].removesuffix("_size")
+
+def print_io_report(report):
+    # sum over branches in each collection
+    collections = defaultdict(lambda: {"compressed": 0, "uncompressed": 0})
+    for branch_name,nbytes in report.items():
+        collection = branch_collection(branch_name)
+        for key,val in nbytes.items():
+            collections[collection][key] += val
+    total = sum(nbytes["compressed"] for nbytes in collections.values())
+    print("Bytes read per collection (compressed, uncompressed):")
+    for collection,nbytes in sorted(collections.items(), key=lambda item: item[1]["compressed"], reverse=True):
+        print(f'  {collection:<25} {nbytes["compressed"]/1e6:10.2f} MB {nbytes["uncompressed"]/1e6:10.2f} MB ({nbytes["compressed"]/max(total,1):.1%})')
+
+# read-optimized copy of a Delphes file, e.g. events_fast.root for events.root
+def fast_copy_name(filename):
+    base, ext = os.path.splitext(filename)
+    return f"{base}_fast{ext}"
+
+# ROOT compression settings (100*algorithm + level)
+FAST_COPY_COMPRESSION = {
+    "lz4": 404,
+    "none": 0,
+}
+
+# rewrite the Delphes tree with cheap (or no) compression and larger baskets
+# collections: only copy these (default: all)
+def make_fast_copy(filename, outname=None, collections=None, compression="lz4", basket_size=4*1024*1024):
+    import ROOT
+    if outname is None:
+        outname = fast_copy_name(filename)
+    infile = ROOT.TFile.Open(filename)
+    tree = infile.Get("Delphes")
+    if collections is not None:
+        tree.SetBranchStatus("*", 0)
+        for col in collections:
+            tree.SetBranchStatus(f"{col}*", 1)
+    # write to a temporary name, so an interrupted copy is never used
+    outfile = ROOT.TFile(outname+".tmp", "RECREATE", "", FAST_COPY_COMPRESSION[compression])
+    outtree = tree.CloneTree(0)
+    outtree.SetBasketSize("*", basket_size)
+    # not a fast clone: baskets are decompressed and rewritten with the new settings
+    outtree.CopyEntries(tree)
+    outtree.Write()
+    outfile.Close()
+    infile.Close()
+    os.replace(outname+".tmp", outname)
+    return outname
+
+# use the read-optimized copy if it is newer than the original and has all of the needed collections
+def prefer_fast_copy(filename, collections=None):
+    fastname = fast_copy_name(filename)
+    if not os.path.exists(fastname) or os.path.getmtime(fastname) < os.path.getmtime(filename):
+        return filename
+    import uproot
+    if collections is None:
+        with uproot.open({filename : "Delphes"}) as tree:
+            collections = {branch_collection(name) for name in tree.keys(recursive=False)}
+    with uproot.open({fastname : "Delphes"}) as tree:
+        available = {branch_collection(name) for name in tree.keys(recursive=False)}
+    return fastname if available.issuperset(collections) else filename
+
+# compressed HepMC archives: format -> file extension
+HEPMC_COMPRESSION = {
+    "gzip": ".gz",
+    "zstd": ".zst",
+}
+HEPMC_MAGIC = {
+    "gzip": b"\x1f\x8b",
+    "zstd": b"\x28\xb5\x2f\xfd",
+}
+# gzip extra subfield with the size of each member (as in BGZF), so members can be located without decompressing
+GZIP_BLOCK_ID = b"MB"
+
+def hepmc_archive_name(filename, compression="gzip"):
+    return filename+HEPMC_COMPRESSION[compression]
+
+# existing archive of filename (newest, if several)
+def find_hepmc_archive(filename):
+    archives = [name for name in (hepmc_archive_name(filename, compression) for compression in HEPMC_COMPRESSION) if os.path.exists(name)]
+    return max(archives, key=os.path.getmtime) if archives else None
+
+def hepmc_compression(filename):
+    with open(filename, "rb") as file:
+        magic = file.read(4)
+    for compression,prefix in HEPMC_MAGIC.items():
+        if magic.startswith(prefix):
+            return compression
+    raise ValueError(f"Unknown compression format for {filename}")
+
+# one complete gzip member (so the concatenation of blocks is a valid multi-member gzip file)
+def gzip_block(data, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    body = compressor.compress(data)+compressor.flush()
+    extra = GZIP_BLOCK_ID+struct.pack("<HI", 4, 12+8+len(body)+8)
+    header = b"\x1f\x8b\x08\x04"+struct.pack("<IBBH", 0, 0, 255, len(extra))
+    return header+extra+body+struct.pack("<II", zlib.crc32(data), len(data) & 0xffffffff)
+
+# sizes of the gzip header + extra field, and of the member (None if not written by gzip_block)
+def read_gzip_block_header(file):
+    header = file.read(12)
+    if len(header)==0:
+        return None, None
+    if len(header)<12 or header[:4]!=b"\x1f\x8b\x08\x04":
+        return header, None
+    extra = file.read(struct.unpack("<H", header[10:12])[0])
+    header += extra
+    if extra[:2]!=GZIP_BLOCK_ID or len(extra)<8:
+        return header, None
+    return header, struct.unpack("<I", extra[4:8])[0]
+
+def gunzip_block(member):
+    body = member[20:-8]
+    data = zlib.decompress(body, -zlib.MAX_WBITS)
+    crc, size = struct.unpack("<II", member[-8:])
+    if zlib.crc32(data)!=crc or len(data) & 0xffffffff!=size:
+        raise ValueError("Corrupted gzip block")
+    return data
+
+# apply func to items from an iterable in threads, yielding results in order, with a bounded number in flight
+def map_ordered(func, items, threads):
+    with ThreadPoolExecutor(threads) as executor:
+        pending = []
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending)>=2*threads:
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
+
+# at least one (possibly empty) block, so that an empty input still gives a valid archive
+def read_blocks(file, block_size):
+    block = file.read(block_size)
+    while True:
+        yield block
+        block = file.read(block_size)
+        if not block:
+            return
+
+# compress in independent blocks on several threads (zlib releases the GIL)
+# gzip: multi-member file, readable by gunzip -c; zstd: multi-threaded zstd command
+def compress_hepmc(filename, outname, compression="gzip", threads=1, level=6, block_size=16*1024*1024):
+    if compression=="zstd":
+        subprocess.check_call(["zstd", "-q", "-f", f"-T{threads}", f"-{level}", filename, "-o", outname])
+        # zstd copies the input timestamp
+        os.utime(outname)
+        return outname
+    with open(filename, "rb") as ifile, open(outname, "wb") as ofile:
+        for block in map_ordered(lambda data: gzip_block(data, level), read_blocks(ifile, block_size), threads):
+            ofile.write(block)
+    return outname
+
+def read_gzip_blocks(file):
+    while True:
+        header, size = read_gzip_block_header(file)
+        if header is None:
+            return
+        if size is None:
+            raise ValueError("Not a block-compressed gzip file")
+        yield header+file.read(size-len(header))
+
+# write the decompressed contents of an archive to a binary file object (e.g. the stdin of a process)
+# block-compressed gzip members are decompressed on several threads; other gzip files sequentially
+def decompress_hepmc(filename, ofile, threads=1):
+    compression = hepmc_compression(filename)
+    if compression=="zstd":
+        ofile.flush()
+        subprocess.check_call(["zstd", "-q", "-d", "-c", f"-T{threads}", filename], stdout=ofile)
+        return
+    with open(filename, "rb") as file:
+        blocked = read_gzip_block_header(file)[1] is not None
+    if not blocked:
+        with gzip.open(filename, "rb") as ifile:
+            shutil.copyfileobj(ifile, ofile, 16*1024*1024)
+        return
+    with open(filename, "rb") as file:
+        for data in map_ordered(gunzip_block, read_gzip_blocks(file), threads):
+            ofile.write(data)
+
 def set_plot_style():
     # stylistic options
     mpl.rcParams.update({
@@ -247,6 +773,38 @@ def resolve_models(pattern):
 
     return glob(pattern[pattern.index("models"):])
 
+# per-jet histograms are stored once, with an integer category axis JET_AXIS (jet 1, jet 2)
+# and JETIND in the label of the value axis
+JET_AXIS = "jet"
+
+# read-only view of a histogram dictionary that also provides the per-jet names:
+# Jet12_x -> Jet1_x, Jet2_x (one category), Jet12_x (projection over both jets)
+class JetHists(Mapping):
+    def __init__(self, hists):
+        self.hists = hists
+        self.views = {}
+        for name,h in hists.items():
+            if JET_AXIS not in h.axes.name:
+                self.views[name] = (name, None, None)
+                continue
+            for key,ind,label in [("1",1,"1"), ("2",2,"2"), ("12",None,"1,2")]:
+                self.views[name.replace("Jet12",f"Jet{key}")] = (name, ind, label)
+
+    def __getitem__(self, key):
+        name, ind, label = self.views[key]
+        h = self.hists[name]
+        if label is None:
+            return h
+        h = h[{JET_AXIS: sum if ind is None else h.axes[JET_AXIS].index(ind)}]
+        h.axes[0].label = h.axes[0].label.replace("JETIND", label)
+        return h
+
+    def __iter__(self):
+        return iter(self.views)
+
+    def __len__(self):
+        return len(self.views)
+
 def accumulate_data(samples):
     data = {} # hists + metadata for all models
     for sample in samples:
@@ -259,6 +817,7 @@ def accumulate_data(samples):
                 # track filename
                 data_model['file'] = file
                 data_model['meta'] = data_model['model'] | data_model['analysis']
+                data_model['hist'] = JetHists(data_model['hist'])
 
             data[sample["name"]].append(data_model)
     return data
\ No newline at end of file
@@ -15,6 +15,8 @@ done
 PKGS=(
 magiconfig \
 fastjet \
+lz4 \
+xxhash \
 )
 
 for PKG in ${PKGS[@]}; do